@@ -0,0 +1,146 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Compares the embeddings backends of nlq_embeddings.py: sentence-transformers on PyTorch, and the
+# ONNX Runtime export of the same model, full precision and int8-quantized. Each backend runs in
+# a fresh Python process and reports its load time (imports included), per-question embedding
+# latency and peak memory, and how closely its vectors match the first backend's.
+# Usage: python benchmark/embeddings_benchmark.py --backends huggingface onnx onnx-int8
+#   python benchmark/embeddings_benchmark.py --iterations 20 --output embeddings.json
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import yaml
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DOCKER_DIR = os.path.dirname(BENCHMARK_DIR)
+SAMPLE_QUESTIONS_FILE = os.path.join(BENCHMARK_DIR, "sample_questions.yaml")
+BACKENDS = {
+    "huggingface": ("huggingface", False),
+    "onnx": ("onnx", False),
+    "onnx-int8": ("onnx", True),
+}
+
+
+def max_rss_mb():
+    # peak resident set size of the process; ru_maxrss is in KiB on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_backend(name, model, iterations):
+    # runs in the worker process; prints one JSON result
+    rss_start = max_rss_mb()
+    start = time.perf_counter()
+    sys.path.insert(0, DOCKER_DIR)
+    from nlq_embeddings import create_embeddings
+
+    backend, quantized = BACKENDS[name]
+    embeddings = create_embeddings(model, backend=backend, quantized=quantized)
+    embeddings.embed_query("warm up")
+    load_seconds = time.perf_counter() - start
+
+    with open(SAMPLE_QUESTIONS_FILE, "r") as stream:
+        questions = [question["input"] for question in yaml.safe_load(stream)]
+    latencies = []
+    for _ in range(iterations):
+        for question in questions:
+            start = time.perf_counter()
+            embeddings.embed_query(question)
+            latencies.append(time.perf_counter() - start)
+
+    return {
+        "backend": name,
+        "load_seconds": round(load_seconds, 3),
+        "query_p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "query_p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "rss_start_mb": round(rss_start, 1),
+        "rss_peak_mb": round(max_rss_mb(), 1),
+        "vectors": [embeddings.embed_query(question) for question in questions],
+    }
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+    return dot / norm if norm else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare NLQ embeddings backends.")
+    parser.add_argument(
+        "--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS)
+    )
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--worker", choices=list(BACKENDS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.model, args.iterations)))
+        return
+
+    results = []
+    for name in args.backends:
+        process = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--worker",
+                name,
+                "--model",
+                args.model,
+                "--iterations",
+                str(args.iterations),
+            ],
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            # the exception, last line of the traceback
+            error = (process.stderr.strip().splitlines() or ["failed"])[-1]
+            results.append({"backend": name, "error": error})
+            continue
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    # agreement with the first backend that ran, e.g. quantization error
+    reference = next((r["vectors"] for r in results if "vectors" in r), None)
+    for result in results:
+        vectors = result.pop("vectors", None)
+        if vectors is not None:
+            result["min_cosine_vs_first"] = round(
+                min(cosine(a, b) for a, b in zip(vectors, reference)), 4
+            )
+
+    print(f"model {args.model}, {args.iterations} iterations of the sample questions\n")
+    print(
+        f"{'backend':<14}{'load s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'rss MB':>9}{'cosine':>9}"
+    )
+    for result in results:
+        if "error" in result:
+            print(f"{result['backend']:<14}error: {result['error']}")
+            continue
+        print(
+            f"{result['backend']:<14}{result['load_seconds']:>9.2f}"
+            f"{result['query_p50_ms']:>9.2f}{result['query_p95_ms']:>9.2f}"
+            f"{result['rss_peak_mb']:>9.1f}{result['min_cosine_vs_first']:>9.4f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(results, stream, indent=2)
+
+
+if __name__ == "__main__":
+    main()
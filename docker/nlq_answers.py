@@ -0,0 +1,120 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Template answers: results with a simple shape (a single value, a single row, or no rows) are
+# turned into the answer sentence locally, skipping the second LLM call. Each app chooses the
+# shapes it answers this way with ANSWER_FAST_PATH.
+
+import datetime
+import decimal
+import math
+import re
+
+SHAPES = ("scalar", "row", "empty")
+
+# "How many artists are there in the collection?", then "How many paintings were produced ...?"
+_HOW_MANY_THERE = re.compile(
+    r"^how many (?P<subject>.+) (?P<verb>are|were|is|was) there\b(?P<rest>.*?)\W*$",
+    re.I,
+)
+_HOW_MANY = re.compile(
+    r"^how many (?P<subject>.+?) (?P<verb>are|were|is|was|have|has|had) "
+    r"(?P<rest>.+?)\W*$",
+    re.I,
+)
+# questions whose number is not a count of the subject, e.g. "How many artists are deceased as a
+# percentage of all artists?"
+_NOT_A_COUNT = re.compile(
+    r"\b(percent\w*|ratio|proportion|share|fraction|average|avg|mean|median|rate)\b",
+    re.I,
+)
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def fast_path_shapes(value):
+    # "scalar,row,empty" -> ["scalar", "row", "empty"]; "" or "none" -> []
+    shapes = [shape.strip().lower() for shape in (value or "").split(",")]
+    return [shape for shape in shapes if shape in SHAPES]
+
+
+def result_shape(table):
+    if table is None:
+        return None
+    if table.num_rows == 0:
+        return "empty"
+    if table.num_rows == 1:
+        return "scalar" if table.num_columns == 1 else "row"
+    return None
+
+
+def _format_value(value):
+    if value is None:
+        return "no value"
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, (float, decimal.Decimal)):
+        number = float(value)
+        if not math.isfinite(number):
+            return str(value)
+        if number == int(number):
+            return str(int(number))
+        if abs(number) >= 1:
+            # two decimals, e.g. 63.21, without trailing zeros
+            return f"{number:.2f}".rstrip("0").rstrip(".")
+        # three significant digits, e.g. 0.004 or 1e-07
+        return f"{number:.3g}"
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def _label(column):
+    # count(*) or ?column? are not worth repeating in the answer
+    if not _IDENTIFIER.fullmatch(column) or column.lower() in ("count", "answer"):
+        return None
+    return column.replace("_", " ")
+
+
+def _is_count(question, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, decimal.Decimal)):
+        return False
+    if not math.isfinite(value) or value != int(value):
+        return False
+    return not _NOT_A_COUNT.search(question)
+
+
+def template_answer(question, table, shapes):
+    # the answer sentence, or None when the result's shape is not in shapes and the LLM
+    # should answer
+    shape = result_shape(table)
+    if shape is None or shape not in shapes:
+        return None
+    if shape == "empty":
+        return "No results were found for this question."
+
+    row = {name: table.column(i)[0].as_py() for i, name in enumerate(table.column_names)}
+    if shape == "row":
+        values = ", ".join(
+            f"{_label(name) or name} {_format_value(value)}" for name, value in row.items()
+        )
+        return f"The result is {values}."
+
+    column, value = next(iter(row.items()))
+    if value is None:
+        # NULL, e.g. an average of no rows: the LLM can say why there is no value
+        return None
+    if isinstance(value, str) and column.lower() == "answer":
+        # e.g. SELECT 'Unrelated to the dataset' AS answer, see moma_examples.yaml
+        return None
+    text = _format_value(value)
+    if _is_count(question, value):
+        match = _HOW_MANY_THERE.match(question.strip())
+        if match:
+            subject, verb, rest = match.group("subject", "verb", "rest")
+            return f"There {verb.lower()} {text} {subject}{rest}."
+        match = _HOW_MANY.match(question.strip())
+        if match:
+            subject, verb, rest = match.group("subject", "verb", "rest")
+            return f"{text} {subject} {verb.lower()} {rest}."
+    label = _label(column)
+    if label is not None:
+        return f"The {label} is {text}."
+    return f"The answer is {text}."
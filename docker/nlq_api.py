@@ -0,0 +1,253 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Headless HTTP/JSON API for the NLQ pipeline, for other services and batch jobs.
+# Builds the chain of the provider app from its module without the Streamlit runtime:
+# nlq_bedrock.py, nlq_openai.py or nlq_sagemaker.py, set by each Docker image.
+# Usage: NLQ_CHAIN_MODULE=nlq_bedrock python nlq_api.py
+#   curl -X POST localhost:8080/query -d '{"question": "How many artists are there?"}'
+#   curl -X POST localhost:8080/batch -d '{"questions": ["...", "..."]}'
+#   curl localhost:8080/metrics
+# Listens on localhost only by default; set NLQ_API_HOST=0.0.0.0 together with NLQ_API_TOKEN
+# or NLQ_API_TOKEN_SECRET_ID to serve other hosts, which then send the token as
+# "Authorization: Bearer <token>".
+
+import hmac
+import importlib
+import json
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from nlq_cache import cached_chain_call
+from nlq_clients import ProviderDeadlineError, is_throttling_error
+from nlq_cost_guard import SqlCostError
+from nlq_executor import (
+    NLQ_REQUEST_TIMEOUT_SECONDS,
+    CancellationHandler,
+    ExecutorBusyError,
+    get_executor,
+)
+from nlq_metrics import METRICS, render_prometheus
+from nlq_results import is_truncated, table_rows
+from nlq_secrets import get_secret_cache
+from nlq_sql_validator import SqlValidationError
+
+# ***** CONFIGURABLE PARAMETERS *****
+NLQ_CHAIN_MODULE = os.environ.get("NLQ_CHAIN_MODULE", "nlq_bedrock")
+NLQ_API_HOST = os.environ.get("NLQ_API_HOST", "127.0.0.1")
+NLQ_API_PORT = int(os.environ.get("NLQ_API_PORT", 8080))
+NLQ_API_MAX_BATCH = int(os.environ.get("NLQ_API_MAX_BATCH", 100))
+NLQ_API_MAX_BODY_BYTES = int(os.environ.get("NLQ_API_MAX_BODY_BYTES", 1024 * 1024))
+# bearer token required for /query, /batch and /metrics, from the environment or from an
+# AWS Secrets Manager secret; no authentication when neither is set
+NLQ_API_TOKEN = os.environ.get("NLQ_API_TOKEN", "")
+NLQ_API_TOKEN_SECRET_ID = os.environ.get("NLQ_API_TOKEN_SECRET_ID", "")
+REGION_NAME = os.environ.get("REGION_NAME", "us-east-1")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def api_token():
+    # the token clients must send, or None; a secret is cached for SECRETS_TTL_SECONDS,
+    # see nlq_secrets.py, so a rotated token is picked up
+    if NLQ_API_TOKEN:
+        return NLQ_API_TOKEN
+    if NLQ_API_TOKEN_SECRET_ID:
+        return get_secret_cache(REGION_NAME).get(NLQ_API_TOKEN_SECRET_ID)
+    return None
+
+
+def submit_question(question):
+    provider = importlib.import_module(NLQ_CHAIN_MODULE)
+    sql_db_chain = provider.load_chain()
+    answer_cache = provider.load_answer_cache()
+
+    cancel_handler = CancellationHandler()
+    task = get_executor().submit(
+        cached_chain_call,
+        sql_db_chain,
+        answer_cache,
+        question,
+        callbacks=[cancel_handler],
+    )
+    task.on_cancel(cancel_handler.cancel)
+    return task
+
+
+def task_response(question, task, timeout=NLQ_REQUEST_TIMEOUT_SECONDS):
+    remaining = max(0.0, timeout - task.elapsed())
+    if not task.wait(remaining):
+        task.cancel()
+        raise ApiError(504, f"No answer within {timeout} seconds.")
+
+    # raises the task's error, if any
+    return format_output(question, task.result(), task)
+
+
+def format_output(question, output, task):
+    intermediate_steps = output.get("intermediate_steps", [])
+    sql_result = intermediate_steps[3] if len(intermediate_steps) > 3 else ""
+    result_table = output.get("result_table")
+
+    return {
+        "question": question,
+        "sql": intermediate_steps[1] if len(intermediate_steps) > 1 else None,
+        "columns": result_table.column_names if result_table is not None else None,
+        "rows": table_rows(result_table),
+        "truncated": is_truncated(result_table),
+        "sql_result": sql_result,
+        "answer": output.get("result"),
+        "answer_path": output.get("answer_path"),
+        "answer_cache": output.get("answer_cache"),
+        "timings": {
+            "queue_seconds": round(task.wait_time(), 4),
+            "total_seconds": round(task.elapsed(), 4),
+        },
+        "stages": output.get("stages"),
+        "sql_estimate": output.get("sql_estimate"),
+    }
+
+
+def answer_question(question):
+    return task_response(question, submit_question(question))
+
+
+def answer_batch(questions):
+    # fan all questions out to the worker pool at once, then collect the answers in order
+    tasks = []
+    for question in questions:
+        try:
+            tasks.append(submit_question(question))
+        except ExecutorBusyError as e:
+            tasks.append(e)
+
+    results = []
+    for question, task in zip(questions, tasks):
+        if isinstance(task, Exception):
+            results.append({"question": question, "error": str(task)})
+            continue
+        try:
+            results.append(task_response(question, task))
+        except Exception as e:
+            logging.error(e)
+            results.append({"question": question, "error": str(e)})
+    return {"results": results}
+
+
+class NlqRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            if self.path == "/health":
+                # unauthenticated, for load balancer and container health checks
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                self._authorize()
+                body = render_prometheus(METRICS.snapshot()).encode("utf-8")
+                self._send(200, "text/plain; version=0.0.4", body)
+            else:
+                raise ApiError(404, f"Unknown path: {self.path}")
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)})
+
+    def do_POST(self):
+        try:
+            self._authorize()
+            body = self._read_json()
+            if self.path == "/query":
+                self._send_json(200, answer_question(self._question(body)))
+            elif self.path == "/batch":
+                questions = body.get("questions")
+                if not isinstance(questions, list) or not questions:
+                    raise ApiError(400, "'questions' must be a non-empty list.")
+                if len(questions) > NLQ_API_MAX_BATCH:
+                    raise ApiError(400, f"At most {NLQ_API_MAX_BATCH} questions.")
+                questions = [self._question({"question": q}) for q in questions]
+                self._send_json(200, answer_batch(questions))
+            else:
+                raise ApiError(404, f"Unknown path: {self.path}")
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except ExecutorBusyError as e:
+            self._send_json(503, {"error": str(e)})
+        except (SqlCostError, SqlValidationError) as e:
+            self._send_json(422, {"error": str(e)})
+        except ProviderDeadlineError as e:
+            # the LLM provider did not answer in time, see nlq_clients.py
+            self._send_json(504, {"error": str(e)})
+        except Exception as e:
+            logging.error(e)
+            # still throttled by the LLM provider after all retries, see nlq_clients.py
+            status = 503 if is_throttling_error(e) else 500
+            self._send_json(status, {"error": str(e)})
+
+    def _authorize(self):
+        token = api_token()
+        if token is None:
+            return
+        header = self.headers.get("Authorization", "")
+        scheme, _, credentials = header.partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(
+            credentials.strip().encode("utf-8"), token.encode("utf-8")
+        ):
+            raise ApiError(401, "Missing or invalid bearer token.")
+
+    def _read_json(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            raise ApiError(400, "Invalid Content-Length.")
+        if length < 0:
+            raise ApiError(400, "Invalid Content-Length.")
+        if length > NLQ_API_MAX_BODY_BYTES:
+            # not read, the connection is closed after the response
+            raise ApiError(413, f"Request body over {NLQ_API_MAX_BODY_BYTES} bytes.")
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise ApiError(400, f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Request body must be a JSON object.")
+        return body
+
+    @staticmethod
+    def _question(body):
+        question = body.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise ApiError(400, "'question' must be a non-empty string.")
+        return question.strip()
+
+    def _send_json(self, status, payload):
+        # default=str covers Decimal, date and datetime values in result rows
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self._send(status, "application/json", body)
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    # build the chain up front rather than on the first request
+    importlib.import_module(NLQ_CHAIN_MODULE).load_chain()
+
+    if api_token() is None and NLQ_API_HOST not in ("127.0.0.1", "localhost", "::1"):
+        logging.warning(
+            f"NLQ API listening on {NLQ_API_HOST} without authentication, set "
+            f"NLQ_API_TOKEN or NLQ_API_TOKEN_SECRET_ID"
+        )
+    server = ThreadingHTTPServer((NLQ_API_HOST, NLQ_API_PORT), NlqRequestHandler)
+    logging.info(f"NLQ API listening on {NLQ_API_HOST}:{NLQ_API_PORT}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
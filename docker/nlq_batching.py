@@ -0,0 +1,194 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Micro-batching of Amazon SageMaker endpoint invocations: prompts sent by concurrent sessions
+# within a few milliseconds of each other, to the same endpoint with the same parameters, go
+# out as one request with a list of text_inputs, which JumpStart text2text containers accept.
+# The generated_texts are handed back to each caller as if it had invoked the endpoint alone.
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from botocore.exceptions import ClientError
+
+from nlq_clients import (
+    ProviderDeadlineError,
+    get_sagemaker_client,
+    is_throttling_error,
+)
+from nlq_metrics import METRICS
+from nlq_resources import RESOURCES
+
+# ***** CONFIGURABLE PARAMETERS *****
+SAGEMAKER_BATCHING_ENABLED = (
+    os.environ.get("SAGEMAKER_BATCHING_ENABLED", "true").lower() == "true"
+)
+SAGEMAKER_BATCH_MAX_SIZE = int(os.environ.get("SAGEMAKER_BATCH_MAX_SIZE", 8))
+# how long the first prompt of a batch waits for others
+SAGEMAKER_BATCH_WINDOW_MS = float(os.environ.get("SAGEMAKER_BATCH_WINDOW_MS", 10))
+# how long an endpoint that rejected a batched request is sent unbatched requests
+SAGEMAKER_BATCH_RETRY_SECONDS = float(
+    os.environ.get("SAGEMAKER_BATCH_RETRY_SECONDS", 600)
+)
+
+# a caller whose batch failed sends its own request instead
+_UNBATCHED = object()
+
+
+class _Batch:
+    def __init__(self):
+        self.prompts = []
+        self.futures = []
+        self.enqueued_at = []
+        self.full = threading.Event()
+
+
+class SageMakerBatcher:
+    # stands in for the sagemaker-runtime client of SagemakerEndpoint; invoke_endpoint calls
+    # are batched, everything else (e.g. response streaming) goes to the client unchanged
+    def __init__(
+        self,
+        client,
+        max_size=SAGEMAKER_BATCH_MAX_SIZE,
+        window_ms=SAGEMAKER_BATCH_WINDOW_MS,
+        retry_seconds=SAGEMAKER_BATCH_RETRY_SECONDS,
+    ):
+        self._client = client
+        self._max_size = max_size
+        self._window = window_ms / 1000
+        self._retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._open = {}  # request key -> batch still accepting prompts
+        # endpoint -> time until which it is sent unbatched requests, after it rejected
+        # a batched request
+        self._unsupported = {}
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def invoke_endpoint(self, **kwargs):
+        request = self._parse(kwargs)
+        if request is None or self._max_size < 2:
+            return self._client.invoke_endpoint(**kwargs)
+        key, prompt, parameters = request
+
+        future = Future()
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            batch.prompts.append(prompt)
+            batch.futures.append(future)
+            batch.enqueued_at.append(time.perf_counter())
+            if len(batch.prompts) >= self._max_size:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self._window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            if len(batch.prompts) == 1:
+                # nobody joined: the original request, unchanged
+                self._observe(batch)
+                return self._client.invoke_endpoint(**kwargs)
+            self._send(batch, kwargs, parameters)
+
+        text = future.result()
+        if text is _UNBATCHED:
+            return self._client.invoke_endpoint(**kwargs)
+        body = json.dumps({"generated_texts": [text]}).encode("utf-8")
+        return {"Body": io.BytesIO(body), "ContentType": kwargs.get("Accept")}
+
+    def _parse(self, kwargs):
+        # (batch key, prompt, other parameters), or None for requests that are not a
+        # single JSON text_inputs prompt
+        endpoint = kwargs.get("EndpointName")
+        if self._unsupported.get(endpoint, 0) > time.monotonic():
+            return None
+        try:
+            parameters = json.loads(kwargs["Body"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not isinstance(parameters, dict):
+            return None
+        prompt = parameters.pop("text_inputs", None)
+        if not isinstance(prompt, str):
+            return None
+        options = {name: value for name, value in kwargs.items() if name != "Body"}
+        key = json.dumps([options, parameters], sort_keys=True, default=str)
+        return key, prompt, parameters
+
+    def _observe(self, batch):
+        sent_at = time.perf_counter()
+        METRICS.observe("sagemaker_batch_size", len(batch.prompts))
+        for enqueued_at in batch.enqueued_at:
+            METRICS.observe("sagemaker_batch_queue_delay_seconds", sent_at - enqueued_at)
+
+    def _send(self, batch, kwargs, parameters):
+        self._observe(batch)
+        body = json.dumps({"text_inputs": batch.prompts, **parameters})
+        try:
+            response = self._client.invoke_endpoint(
+                **{**kwargs, "Body": body.encode("utf-8")}
+            )
+            texts = json.loads(response["Body"].read().decode("utf-8"))[
+                "generated_texts"
+            ]
+            if len(texts) != len(batch.prompts):
+                raise ValueError(
+                    f"{len(texts)} generated_texts for {len(batch.prompts)} prompts"
+                )
+        except Exception as e:
+            if is_throttling_error(e) or isinstance(
+                e, (TimeoutError, ProviderDeadlineError)
+            ):
+                # the callers' own requests would fare no better
+                for future in batch.futures:
+                    future.set_exception(e)
+                return
+            endpoint = kwargs.get("EndpointName")
+            if _is_rejection(e):
+                # e.g. a container that does not accept a list of text_inputs
+                logging.warning(
+                    f"{endpoint} rejected a batched request, not batching for "
+                    f"{self._retry_seconds:.0f}s: {e}"
+                )
+                METRICS.incr("sagemaker_batch_unsupported")
+                self._unsupported[endpoint] = time.monotonic() + self._retry_seconds
+            else:
+                # e.g. a transient error: only this batch's prompts are sent one by one
+                logging.warning(f"Batched request to {endpoint} failed: {e}")
+                METRICS.incr("sagemaker_batch_failed")
+            for future in batch.futures:
+                future.set_result(_UNBATCHED)
+            return
+
+        METRICS.incr("sagemaker_batched_requests")
+        for future, text in zip(batch.futures, texts):
+            future.set_result(text)
+
+
+def _is_rejection(exc):
+    # the endpoint or its container rejected the request's input (4xx), as opposed to
+    # failing to process it
+    if not isinstance(exc, ClientError):
+        return False
+    error = exc.response.get("Error", {})
+    if error.get("Code") == "ValidationError":
+        return True
+    status = exc.response.get("OriginalStatusCode")
+    return error.get("Code") == "ModelError" and status is not None and 400 <= status < 500
+
+
+def get_sagemaker_batcher(region_name):
+    # the shared sagemaker-runtime client, batching invoke_endpoint calls across sessions
+    client = get_sagemaker_client(region_name)
+    if not SAGEMAKER_BATCHING_ENABLED:
+        return client
+    return RESOURCES.get(f"sagemaker_batcher_{region_name}", SageMakerBatcher, client)
@@ -0,0 +1,128 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Prompt token budget: the few-shot prompt gets the largest number of examples (k), most
+# similar first, that fits the provider's token budget together with the instructions, the
+# live table_info and the question, leaving room for the completion. At each k, examples are
+# first tried in full, then truncated: tables named instead of described, and long SQL
+# results shortened.
+
+import logging
+import math
+import os
+
+from nlq_chain import estimate_tokens
+from nlq_metrics import METRICS
+
+# ***** CONFIGURABLE PARAMETERS *****
+PROMPT_BUDGET_ENABLED = os.environ.get("PROMPT_BUDGET_ENABLED", "true").lower() == "true"
+# examples retrieved per question, the most the budget can fit
+PROMPT_MAX_EXAMPLES = int(os.environ.get("PROMPT_MAX_EXAMPLES", 3))
+# characters kept of an example's SQL result when examples are truncated
+PROMPT_EXAMPLE_RESULT_CHARS = int(os.environ.get("PROMPT_EXAMPLE_RESULT_CHARS", 100))
+# Hugging Face tokenizer (model name or tokenizer.json path) matching the model, e.g.
+# google/flan-t5-xxl; empty for the provider's default, see token_counter
+PROMPT_TOKENIZER = os.environ.get("PROMPT_TOKENIZER", "")
+# tokens of the budget kept for the generated SQL, the model's max output tokens, e.g. the
+# 256 max_tokens of prompts sent with cache points, see nlq_prompt_cache.py
+PROMPT_COMPLETION_TOKENS = int(os.environ.get("PROMPT_COMPLETION_TOKENS", 256))
+# multiplier for prompt tokens estimated at four characters per token, which undercounts
+# SQL, numbers and punctuation
+PROMPT_ESTIMATE_MARGIN = float(os.environ.get("PROMPT_ESTIMATE_MARGIN", 1.25))
+
+
+def _huggingface_counter(name):
+    from tokenizers import Tokenizer
+
+    if os.path.exists(name):
+        tokenizer = Tokenizer.from_file(name)
+    else:
+        tokenizer = Tokenizer.from_pretrained(name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def _tiktoken_counter(model_name):
+    import tiktoken
+
+    try:
+        encoding = tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def token_counter(llm, tokenizer=PROMPT_TOKENIZER):
+    # (name, count function) for the provider's tokenizer: PROMPT_TOKENIZER if set, tiktoken
+    # for OpenAI, otherwise about four characters per token; falls back to the estimate
+    # when the tokenizer cannot be loaded, e.g. without network access
+    try:
+        if tokenizer:
+            return tokenizer, _huggingface_counter(tokenizer)
+        model_name = getattr(llm, "model_name", None)
+        if llm._llm_type == "openai-chat" and model_name:
+            return f"tiktoken:{model_name}", _tiktoken_counter(model_name)
+    except Exception as e:
+        logging.warning(f"Unable to load tokenizer, estimating prompt tokens: {e}")
+    return "estimate", estimate_tokens
+
+
+class PromptBudget:
+    # max_tokens is the budget of a call, prompt and completion; the prompt gets max_tokens
+    # less completion_tokens
+    def __init__(
+        self,
+        max_tokens,
+        counter,
+        counter_name="estimate",
+        completion_tokens=PROMPT_COMPLETION_TOKENS,
+        margin=1.0,
+    ):
+        self.max_tokens = max(0, max_tokens - completion_tokens)
+        self._count = counter
+        self._counter_name = counter_name
+        self._margin = margin
+
+    def count(self, text):
+        if not text:
+            return 0
+        return math.ceil(self._count(text) * self._margin)
+
+    def fit(self, base, candidates, separator_tokens=1):
+        # (k, truncated, prompt tokens) for the prompt without examples (base) and the
+        # examples as (full, truncated) text, most similar first
+        base_tokens = self.count(base)
+        full = [self.count(text) for text, _ in candidates]
+        truncated = [self.count(text) for _, text in candidates]
+
+        choice = None
+        for k in range(len(candidates), 0, -1):
+            for shortened, sizes in ((False, full), (True, truncated)):
+                tokens = base_tokens + sum(sizes[:k]) + k * separator_tokens
+                if tokens <= self.max_tokens:
+                    choice = (k, shortened, tokens)
+                    break
+            if choice is not None:
+                break
+        if choice is None:
+            choice = (0, False, base_tokens)
+            if base_tokens > self.max_tokens:
+                METRICS.incr("prompt_budget_exceeded")
+
+        k, shortened, tokens = choice
+        METRICS.observe("prompt_few_shot_k", k)
+        METRICS.observe("prompt_budget_tokens", tokens)
+        if shortened:
+            METRICS.incr("prompt_examples_truncated")
+        logging.info(
+            f"Prompt budget: k={k} of {len(candidates)} examples"
+            f"{' (truncated)' if shortened else ''}, {tokens} of {self.max_tokens} "
+            f"prompt tokens ({self._counter_name})"
+        )
+        return choice
+
+
+def load_prompt_budget(llm, max_tokens):
+    if not PROMPT_BUDGET_ENABLED:
+        return None
+    counter_name, counter = token_counter(llm)
+    # a tokenizer counts exactly, the estimate gets a safety margin
+    margin = PROMPT_ESTIMATE_MARGIN if counter_name == "estimate" else 1.0
+    return PromptBudget(max_tokens, counter, counter_name, margin=margin)
@@ -0,0 +1,318 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Semantic answer cache: a question whose embedding is close enough to a previously answered
+# question, and that names the same values (quoted strings, numbers and proper nouns), reuses that
+# question's SQL, result and answer instead of calling the LLM and database.
+# SQL result cache: generated statements that canonicalize to the same SQL reuse the result,
+# until it expires or one of the tables it reads changes.
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from nlq_chain import RESULT_TABLE_KEY
+from nlq_metrics import METRICS
+from nlq_resources import RESOURCES
+from nlq_results import result_sql, table_nbytes
+from nlq_sql import is_select, normalize_sql, referenced_tables
+
+# ***** CONFIGURABLE PARAMETERS *****
+# off by default: a cached answer is given to similar questions, which need not have the same
+# answer even when they name the same values
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.95))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 512))
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 3600))
+ANSWER_CACHE_MAX_BYTES = int(
+    os.environ.get("ANSWER_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+SQL_CACHE_ENABLED = os.environ.get("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_MAX_ENTRIES = int(os.environ.get("SQL_CACHE_MAX_ENTRIES", 1024))
+SQL_CACHE_TTL_SECONDS = int(os.environ.get("SQL_CACHE_TTL_SECONDS", 300))
+SQL_CACHE_MAX_BYTES = int(os.environ.get("SQL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+_QUOTED_OR_NUMBER = re.compile(r"'([^']*)'|\"([^\"]*)\"|(\d+(?:\.\d+)?)")
+_PROPER_NOUN = re.compile(r"\b[A-Z][\w-]*")
+
+
+def question_literals(question):
+    # the values a question names, e.g. 'Italian', 1900 or Picasso; questions that differ
+    # only in such a value embed almost identically, but have different answers
+    question = question.strip()
+    literals = [
+        next(group for group in match.groups() if group is not None)
+        for match in _QUOTED_OR_NUMBER.finditer(question)
+    ]
+    # capitalized words, except the question's first word
+    rest = question.split(maxsplit=1)[1] if " " in question else ""
+    literals += _PROPER_NOUN.findall(_QUOTED_OR_NUMBER.sub(" ", rest))
+    return tuple(sorted(literal.lower() for literal in literals))
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        embeddings,
+        similarity=ANSWER_CACHE_SIMILARITY,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl=ANSWER_CACHE_TTL_SECONDS,
+        max_bytes=ANSWER_CACHE_MAX_BYTES,
+        table_names=None,
+    ):
+        self._embeddings = embeddings
+        # usable table names, to tag answers with the tables their SQL reads
+        self._table_names = table_names
+        self._similarity = similarity
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # question -> (unit vector, output, stored_at, size, literals, tables or None for
+        # all), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def lookup(self, question):
+        # returns (output, vector); output is None on a miss, vector can be passed to store()
+        vector = self._embed(question)
+        literals = question_literals(question)
+
+        with self._lock:
+            self._expire()
+            best_question, best_similarity = None, -1.0
+            for cached_question, entry in self._entries.items():
+                cached_vector, cached_literals = entry[0], entry[4]
+                if cached_literals != literals:
+                    continue
+                similarity = float(np.dot(vector, cached_vector))
+                if similarity > best_similarity:
+                    best_question, best_similarity = cached_question, similarity
+
+            if best_question is None or best_similarity < self._similarity:
+                METRICS.incr("answer_cache_misses")
+                return None, vector
+
+            self._entries.move_to_end(best_question)
+            output = dict(self._entries[best_question][1])
+
+        METRICS.incr("answer_cache_hits")
+        output["answer_cache"] = {
+            "question": best_question,
+            "similarity": round(best_similarity, 4),
+        }
+        return output, vector
+
+    def store(self, question, output, vector=None):
+        if vector is None:
+            vector = self._embed(question)
+        size = (
+            vector.nbytes
+            + len(repr(output))
+            + table_nbytes(output.get(RESULT_TABLE_KEY))
+        )
+        if size > self._max_bytes:
+            return
+        entry = (
+            vector,
+            output,
+            time.monotonic(),
+            size,
+            question_literals(question),
+            self._tables(output),
+        )
+
+        with self._lock:
+            if question in self._entries:
+                self._bytes -= self._entries.pop(question)[3]
+            self._entries[question] = entry
+            self._bytes += size
+            while (
+                len(self._entries) > self._max_entries or self._bytes > self._max_bytes
+            ):
+                self._bytes -= self._entries.popitem(last=False)[1][3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def invalidate_tables(self, tables=None):
+        # drop answers reading any of the tables (all answers if tables is None), see
+        # SqlResultCache.invalidate_tables
+        with self._lock:
+            stale = [
+                question
+                for question, entry in self._entries.items()
+                if tables is None or entry[5] is None or not entry[5].isdisjoint(tables)
+            ]
+            for question in stale:
+                self._bytes -= self._entries.pop(question)[3]
+        if stale:
+            METRICS.incr("answer_cache_invalidations", len(stale))
+
+    def stats(self):
+        return {
+            "hits": METRICS.counter_value("answer_cache_hits"),
+            "misses": METRICS.counter_value("answer_cache_misses"),
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def _embed(self, question):
+        vector = np.asarray(
+            self._embeddings.embed_query(question.strip()), dtype=np.float32
+        )
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _tables(self, output):
+        sql = result_sql(output.get(RESULT_TABLE_KEY))
+        if self._table_names is None or sql is None:
+            return None
+        return frozenset(referenced_tables(sql, self._table_names()))
+
+    def _expire(self):
+        # entries are in LRU order, not insertion order, so check them all
+        now = time.monotonic()
+        expired = [
+            question
+            for question, entry in self._entries.items()
+            if now - entry[2] > self._ttl
+        ]
+        for question in expired:
+            self._bytes -= self._entries.pop(question)[3]
+
+
+def create_answer_cache(embeddings, db, *args):
+    cache = SemanticAnswerCache(
+        embeddings, *args, table_names=db.get_usable_table_names
+    )
+    # answers reading a changed table are dropped, as cached SQL results are
+    db.schema_cache.add_listener(cache.invalidate_tables)
+    return cache
+
+
+def get_answer_cache(embeddings, db):
+    # one cache per process, shared by all user sessions
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    return RESOURCES.get(
+        "answer_cache",
+        create_answer_cache,
+        embeddings,
+        db,
+        ANSWER_CACHE_SIMILARITY,
+        ANSWER_CACHE_MAX_ENTRIES,
+        ANSWER_CACHE_TTL_SECONDS,
+        ANSWER_CACHE_MAX_BYTES,
+    )
+
+
+def cached_chain_call(sql_db_chain, answer_cache, question, callbacks=None):
+    # run the NLQ chain, unless a near-duplicate question has already been answered
+    if answer_cache is None:
+        return sql_db_chain(question, callbacks=callbacks)
+
+    start = time.perf_counter()
+    output, vector = answer_cache.lookup(question)
+    lookup_seconds = time.perf_counter() - start
+    METRICS.observe("stage_answer_cache_lookup_seconds", lookup_seconds)
+    if output is None:
+        output = sql_db_chain(question, callbacks=callbacks)
+        answer_cache.store(question, output, vector)
+        stages = output.get("stages") or {"seconds": {}, "tokens": {}}
+        seconds = {"answer_cache_lookup": round(lookup_seconds, 6), **stages["seconds"]}
+        seconds["total"] = round(seconds.get("total", 0.0) + lookup_seconds, 6)
+        output = {**output, "stages": {**stages, "seconds": seconds}}
+    else:
+        # the stages of the original question were not run again
+        output["stages"] = {
+            "seconds": {
+                "answer_cache_lookup": round(lookup_seconds, 6),
+                "total": round(lookup_seconds, 6),
+            },
+            "tokens": {},
+        }
+    return output
+
+
+class SqlResultCache:
+    def __init__(
+        self,
+        max_entries=SQL_CACHE_MAX_ENTRIES,
+        ttl=SQL_CACHE_TTL_SECONDS,
+        max_bytes=SQL_CACHE_MAX_BYTES,
+    ):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # normalized sql -> ((text, table), tables, stored_at, size), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def cacheable(sql):
+        return is_select(sql)
+
+    def get(self, sql):
+        key = normalize_sql(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] > self._ttl:
+                self._bytes -= self._entries.pop(key)[3]
+                entry = None
+            if entry is None:
+                METRICS.incr("sql_cache_misses")
+                return None
+            self._entries.move_to_end(key)
+        METRICS.incr("sql_cache_hits")
+        return entry[0]
+
+    def put(self, sql, table_names, result):
+        # entries are tagged with the tables they read, for invalidate_tables()
+        key = normalize_sql(sql)
+        tables = frozenset(referenced_tables(sql, table_names))
+        result_text, result_table = result
+        size = len(key) + len(result_text) + table_nbytes(result_table)
+        if size > self._max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[3]
+            self._entries[key] = (result, tables, time.monotonic(), size)
+            self._bytes += size
+            while (
+                len(self._entries) > self._max_entries or self._bytes > self._max_bytes
+            ):
+                self._bytes -= self._entries.popitem(last=False)[1][3]
+
+    def invalidate_tables(self, tables=None):
+        # drop entries reading any of the tables (all entries if tables is None)
+        with self._lock:
+            stale = [
+                key
+                for key, (_, entry_tables, _, _) in self._entries.items()
+                if tables is None or not entry_tables.isdisjoint(tables)
+            ]
+            for key in stale:
+                self._bytes -= self._entries.pop(key)[3]
+        if stale:
+            METRICS.incr("sql_cache_invalidations", len(stale))
+
+
+def get_sql_result_cache():
+    # one cache per process, shared by all user sessions
+    if not SQL_CACHE_ENABLED:
+        return None
+    return RESOURCES.get(
+        "sql_result_cache",
+        SqlResultCache,
+        SQL_CACHE_MAX_ENTRIES,
+        SQL_CACHE_TTL_SECONDS,
+        SQL_CACHE_MAX_BYTES,
+    )
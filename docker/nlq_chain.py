@@ -0,0 +1,421 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# SQLDatabaseChain with per-stage timing and token counts: example selection, prompt assembly,
+# SQL generation, SQL execution and answer generation. Each question's stages are returned with
+# the chain output, recorded as rolling histograms, and logged as a CloudWatch EMF record.
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, List, Optional
+
+from langchain.chains.llm import LLMChain
+from langchain.prompts.prompt import PromptTemplate
+from langchain_community.tools.sql_database.prompt import QUERY_CHECKER
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForChainRun
+from langchain_experimental.sql.base import INTERMEDIATE_STEPS_KEY, SQL_QUERY
+from langchain_experimental.sql import SQLDatabaseChain
+
+from nlq_answers import result_shape, template_answer
+from nlq_metrics import METRICS, emit_emf
+from nlq_sql_validator import SqlValidationError
+
+STAGES_KEY = "stages"
+# typed result columns of the generated SQL, see nlq_results.py
+RESULT_TABLE_KEY = "result_table"
+# planner estimate of the generated SQL, see nlq_cost_guard.py
+SQL_ESTIMATE_KEY = "sql_estimate"
+# how the answer was produced: "llm", "template:<shape>" (see nlq_answers.py) or "direct"
+ANSWER_PATH_KEY = "answer_path"
+
+# stages in pipeline order, as shown in the Details tab
+STAGES = [
+    "answer_cache_lookup",
+    "schema_selection",
+    "table_info",
+    "example_selection",
+    "prompt_assembly",
+    "sql_generation",
+    "sql_validation",
+    "query_checker",
+    "cost_guard",
+    "sql_execution",
+    "answer_template",
+    "answer_generation",
+    "total",
+]
+
+_current = threading.local()
+
+
+def estimate_tokens(text):
+    # about four characters per token for English text and SQL, for providers that do not
+    # report token usage
+    return max(1, round(len(text) / 4)) if text else 0
+
+
+@contextmanager
+def current_stage(name):
+    # times a block into the stage timer of the question running on this thread, if any
+    timer = getattr(_current, "timer", None)
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def current_llm_stage():
+    # the LLM stage running on this thread, e.g. "sql_generation", if any
+    timer = getattr(_current, "timer", None)
+    return timer._llm_stage if timer is not None else None
+
+
+def record_tokens(name, count):
+    # adds to the token counts of the question running on this thread, if any
+    timer = getattr(_current, "timer", None)
+    if timer is not None:
+        timer.tokens[name] += count
+
+
+def record_prompt_cache(read_tokens, write_tokens=0):
+    # prompt tokens the provider read from and wrote to its prompt cache in the LLM call
+    # running on this thread; cache hits are counted even without a stage timer, e.g. for
+    # hedged SQL generation, see nlq_prompt_cache.py
+    METRICS.incr("prompt_cache_hits" if read_tokens else "prompt_cache_misses")
+    timer = getattr(_current, "timer", None)
+    if timer is not None:
+        timer.add_prompt_cache(read_tokens, write_tokens)
+
+
+class StageTimer(BaseCallbackHandler):
+    # timings and token counts of one question; within an LLM stage, the time before the
+    # model is called (prompt formatting, including example selection) is prompt assembly
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.tokens = defaultdict(int)
+        self._llm_stage = None
+        self._llm_seconds = 0.0
+        self._llm_started_at = None
+        self._prompt_tokens = 0
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    @contextmanager
+    def llm_stage(self, name):
+        self._llm_stage, self._llm_seconds = name, 0.0
+        selection_before = self.seconds["example_selection"]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            selection = self.seconds["example_selection"] - selection_before
+            self.seconds[name] += self._llm_seconds
+            self.seconds["prompt_assembly"] += max(
+                0.0, elapsed - self._llm_seconds - selection
+            )
+            self._llm_stage = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._start_llm_call("".join(prompts))
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._start_llm_call(
+            "".join(str(message.content) for batch in messages for message in batch)
+        )
+
+    def on_llm_end(self, response, **kwargs):
+        if self._llm_stage is None or self._llm_started_at is None:
+            return
+        self._llm_seconds += time.perf_counter() - self._llm_started_at
+        self._llm_started_at = None
+        self._record_usage(response)
+
+    def add_llm_call(self, seconds, prompt, response):
+        # an LLM call made without this timer's callbacks, e.g. hedged SQL generation,
+        # see nlq_hedging.py
+        if self._llm_stage is None:
+            return
+        self._start_llm_call(prompt)
+        self._llm_started_at = None
+        self._llm_seconds += seconds
+        self._record_usage(response)
+
+    def _record_usage(self, response):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = sum(
+                estimate_tokens(generation.text)
+                for generations in response.generations
+                for generation in generations
+            )
+        elif usage.get("prompt_tokens") is not None:
+            # replace the estimate made at the start of the call
+            self.tokens[f"{self._llm_stage}_prompt"] += (
+                usage["prompt_tokens"] - self._prompt_tokens
+            )
+        self.tokens[f"{self._llm_stage}_completion"] += completion_tokens
+        # OpenAI reports the prompt tokens served from its prompt cache
+        details = usage.get("prompt_tokens_details") or {}
+        if details.get("cached_tokens") is not None:
+            cached_tokens = details["cached_tokens"]
+            METRICS.incr("prompt_cache_hits" if cached_tokens else "prompt_cache_misses")
+            self.add_prompt_cache(cached_tokens)
+
+    def add_prompt_cache(self, read_tokens, write_tokens=0):
+        # prompt tokens read from (and written to) the provider's prompt cache, part of
+        # the stage's prompt tokens
+        if self._llm_stage is None:
+            return
+        self.tokens[f"{self._llm_stage}_prompt_cache_read"] += read_tokens
+        if write_tokens:
+            self.tokens[f"{self._llm_stage}_prompt_cache_write"] += write_tokens
+
+    def _start_llm_call(self, prompt):
+        if self._llm_stage is None:
+            return
+        self._llm_started_at = time.perf_counter()
+        self._prompt_tokens = estimate_tokens(prompt)
+        self.tokens[f"{self._llm_stage}_prompt"] += self._prompt_tokens
+
+    def record(self, dimensions):
+        # rolling histograms for the Details tab and /metrics, and one EMF log record
+        for name, seconds in self.seconds.items():
+            METRICS.observe(f"stage_{name}_seconds", seconds)
+        for name, count in self.tokens.items():
+            METRICS.incr(f"llm_{name}_tokens", count)
+
+        values = {f"{name}_ms": round(s * 1000, 3) for name, s in self.seconds.items()}
+        units = {name: "Milliseconds" for name in values}
+        for name, count in self.tokens.items():
+            values[f"{name}_tokens"] = count
+            units[f"{name}_tokens"] = "Count"
+        emit_emf(values, units, dimensions)
+
+    def as_dict(self):
+        return {
+            "seconds": {
+                name: round(self.seconds[name], 6)
+                for name in STAGES
+                if name in self.seconds
+            },
+            "tokens": dict(self.tokens),
+        }
+
+
+class NlqSQLDatabaseChain(SQLDatabaseChain):
+    # same steps and intermediate_steps as SQLDatabaseChain, with each stage timed, the
+    # typed result columns in the output, and optionally a schema selection stage before
+    # table_info, hedged SQL generation, and SQL validation and cost guard stages before
+    # SQL execution
+    schema_selector: Optional[Any] = None
+    sql_validator: Optional[Any] = None
+    cost_guard: Optional[Any] = None
+    # sends a second SQL generation request when the first is slow, see nlq_hedging.py
+    sql_hedger: Optional[Any] = None
+    # result shapes answered from a template instead of the LLM, see nlq_answers.py
+    answer_fast_path: List[str] = []
+
+    @property
+    def output_keys(self):
+        return super().output_keys + [
+            STAGES_KEY,
+            RESULT_TABLE_KEY,
+            SQL_ESTIMATE_KEY,
+            ANSWER_PATH_KEY,
+        ]
+
+    def _call(self, inputs, run_manager=None):
+        timer = StageTimer()
+        _current.timer = timer
+        try:
+            with timer.stage("total"):
+                outputs = self._call_stages(inputs, timer, run_manager)
+        finally:
+            _current.timer = None
+
+        timer.record({"LLM": self.llm_chain.llm._llm_type})
+        outputs[STAGES_KEY] = timer.as_dict()
+        outputs.setdefault(RESULT_TABLE_KEY, None)
+        outputs.setdefault(SQL_ESTIMATE_KEY, None)
+        outputs.setdefault(ANSWER_PATH_KEY, None)
+        return outputs
+
+    def _call_stages(self, inputs, timer, run_manager=None):
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        callbacks = _run_manager.get_child()
+        callbacks.add_handler(timer, inherit=True)
+
+        input_text = f"{inputs[self.input_key]}\n{SQL_QUERY}"
+        _run_manager.on_text(input_text, verbose=self.verbose)
+        # If not present, then defaults to None which is all tables.
+        table_names_to_use = inputs.get("table_names_to_use")
+        table_info_kwargs = {}
+        if table_names_to_use is None and self.schema_selector is not None:
+            # only the tables and columns relevant to the question, see
+            # nlq_schema_selector.py
+            with timer.stage("schema_selection"):
+                table_names_to_use, table_columns = self.schema_selector.select(
+                    inputs[self.input_key]
+                )
+            if table_columns:
+                table_info_kwargs["table_columns"] = table_columns
+        with timer.stage("table_info"):
+            table_info = self.database.get_table_info(
+                table_names=table_names_to_use, **table_info_kwargs
+            )
+        llm_inputs = {
+            "input": input_text,
+            "top_k": str(self.top_k),
+            "dialect": self.database.dialect,
+            "table_info": table_info,
+            "stop": ["\nSQLResult:"],
+        }
+        if self.memory is not None:
+            for k in self.memory.memory_variables:
+                llm_inputs[k] = inputs[k]
+        intermediate_steps = []
+        try:
+            intermediate_steps.append(llm_inputs.copy())  # input: sql generation
+            with timer.llm_stage("sql_generation"):
+                if self.sql_hedger is not None:
+                    sql_cmd = self.sql_hedger.predict(
+                        self.llm_chain, llm_inputs, callbacks, timer
+                    ).strip()
+                else:
+                    sql_cmd = self.llm_chain.predict(
+                        callbacks=callbacks, **llm_inputs
+                    ).strip()
+            if self.return_sql:
+                return {self.output_key: sql_cmd}
+            problems = None
+            if self.sql_validator is not None:
+                if SQL_QUERY in sql_cmd:
+                    sql_cmd = sql_cmd.split(SQL_QUERY)[1].strip()
+                with timer.stage("sql_validation"):
+                    sql_cmd, problems = self.sql_validator.validate(sql_cmd)
+            # the LLM query checker only runs when local validation fails, see
+            # nlq_sql_validator.py
+            if not self.use_query_checker or problems == []:
+                if problems:
+                    raise SqlValidationError(problems)
+                _run_manager.on_text(sql_cmd, color="green", verbose=self.verbose)
+                intermediate_steps.append(sql_cmd)  # output: sql generation (no checker)
+                intermediate_steps.append({"sql_cmd": sql_cmd})  # input: sql exec
+                if SQL_QUERY in sql_cmd:
+                    sql_cmd = sql_cmd.split(SQL_QUERY)[1].strip()
+            else:
+                query_checker_prompt = self.query_checker_prompt or PromptTemplate(
+                    template=QUERY_CHECKER, input_variables=["query", "dialect"]
+                )
+                query_checker_chain = LLMChain(
+                    llm=self.llm_chain.llm, prompt=query_checker_prompt
+                )
+                query_checker_inputs = {
+                    "query": sql_cmd,
+                    "dialect": self.database.dialect,
+                }
+                with timer.llm_stage("query_checker"):
+                    sql_cmd = query_checker_chain.predict(
+                        callbacks=callbacks, **query_checker_inputs
+                    ).strip()
+                if self.sql_validator is not None:
+                    with timer.stage("sql_validation"):
+                        sql_cmd, problems = self.sql_validator.validate(sql_cmd)
+                    if problems:
+                        raise SqlValidationError(problems)
+                intermediate_steps.append(sql_cmd)  # output: sql generation (checker)
+                _run_manager.on_text(sql_cmd, color="green", verbose=self.verbose)
+                intermediate_steps.append({"sql_cmd": sql_cmd})  # input: sql exec
+
+            # a cached result needs no cost check, nor a database round trip
+            sql_estimate = None
+            with timer.stage("sql_execution"):
+                cached = self.database.cached_result(sql_cmd)
+            if cached is None and self.cost_guard is not None:
+                with timer.stage("cost_guard"):
+                    sql_estimate = self.cost_guard.check(sql_cmd)
+
+            if cached is not None:
+                result, result_table = cached
+            else:
+                with timer.stage("sql_execution"):
+                    result, result_table = self.database.execute_query(sql_cmd)
+            if sql_estimate is not None:
+                self.cost_guard.record(
+                    sql_estimate,
+                    timer.seconds["sql_execution"],
+                    result_table.num_rows if result_table is not None else 0,
+                )
+            intermediate_steps.append(str(result))  # output: sql exec
+
+            _run_manager.on_text("\nSQLResult: ", verbose=self.verbose)
+            _run_manager.on_text(str(result), color="yellow", verbose=self.verbose)
+            # If return direct, we just set the final result equal to
+            # the result of the sql query result, otherwise try to get a human readable
+            # final answer
+            if self.return_direct:
+                final_result = result
+                answer_path = "direct"
+            else:
+                _run_manager.on_text("\nAnswer:", verbose=self.verbose)
+                input_text += f"{sql_cmd}\nSQLResult: {result}\nAnswer:"
+                llm_inputs["input"] = input_text
+                intermediate_steps.append(llm_inputs.copy())  # input: final answer
+                final_result = None
+                if self.answer_fast_path:
+                    with timer.stage("answer_template"):
+                        final_result = template_answer(
+                            inputs[self.input_key], result_table, self.answer_fast_path
+                        )
+                if final_result is not None:
+                    answer_path = f"template:{result_shape(result_table)}"
+                else:
+                    answer_path = "llm"
+                    with timer.llm_stage("answer_generation"):
+                        final_result = self.llm_chain.predict(
+                            callbacks=callbacks, **llm_inputs
+                        ).strip()
+                METRICS.incr(f"answer_path_{answer_path.replace(':', '_')}")
+                intermediate_steps.append(final_result)  # output: final answer
+                _run_manager.on_text(final_result, color="green", verbose=self.verbose)
+            chain_result = {
+                self.output_key: final_result,
+                RESULT_TABLE_KEY: result_table,
+                SQL_ESTIMATE_KEY: sql_estimate,
+                ANSWER_PATH_KEY: answer_path,
+            }
+            if self.return_intermediate_steps:
+                chain_result[INTERMEDIATE_STEPS_KEY] = intermediate_steps
+            return chain_result
+        except Exception as exc:
+            # Append intermediate steps to exception, to aid in logging and later
+            # improvement of few shot prompt seeds
+            exc.intermediate_steps = intermediate_steps
+            raise exc
+
+
+def stage_latency_rows(snapshot):
+    # rolling per-stage latency percentiles, for the Details tab
+    rows = []
+    for name in STAGES:
+        summary = snapshot["histograms"].get(f"stage_{name}_seconds")
+        if summary:
+            rows.append(
+                {
+                    "stage": name,
+                    "p50 (ms)": round(summary["p50"] * 1000, 1),
+                    "p95 (ms)": round(summary["p95"] * 1000, 1),
+                    "p99 (ms)": round(summary["p99"] * 1000, 1),
+                    "count": summary["count"],
+                }
+            )
+    return rows
@@ -0,0 +1,266 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Shared provider clients for Amazon Bedrock, Amazon SageMaker and OpenAI: long-lived pooled
+# HTTP connections with keep-alive, retries with jittered backoff (adaptive client-side rate
+# limiting for AWS), a deadline per LLM call after which failed attempts are no longer retried,
+# and counters of calls, retries, throttled responses and missed deadlines.
+
+import contextlib
+import os
+import threading
+import time
+
+import boto3
+import httpx
+from botocore.config import Config
+from langchain_core.callbacks import BaseCallbackHandler
+
+from nlq_metrics import METRICS
+from nlq_resources import RESOURCES
+
+# ***** CONFIGURABLE PARAMETERS *****
+# connections kept per client; at least the number of workers, see nlq_executor.py
+PROVIDER_MAX_CONNECTIONS = int(os.environ.get("PROVIDER_MAX_CONNECTIONS", 32))
+PROVIDER_KEEPALIVE_SECONDS = float(os.environ.get("PROVIDER_KEEPALIVE_SECONDS", 60))
+# attempts per call, including the first; "adaptive" also rate-limits the client while
+# Amazon Bedrock or SageMaker throttle it, see
+# https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html
+PROVIDER_MAX_ATTEMPTS = int(os.environ.get("PROVIDER_MAX_ATTEMPTS", 5))
+PROVIDER_RETRY_MODE = os.environ.get("PROVIDER_RETRY_MODE", "adaptive")
+PROVIDER_CONNECT_TIMEOUT_SECONDS = float(
+    os.environ.get("PROVIDER_CONNECT_TIMEOUT_SECONDS", 5)
+)
+PROVIDER_READ_TIMEOUT_SECONDS = float(
+    os.environ.get("PROVIDER_READ_TIMEOUT_SECONDS", 60)
+)
+# time allowed per LLM call, retries included
+PROVIDER_DEADLINE_SECONDS = float(os.environ.get("PROVIDER_DEADLINE_SECONDS", 90))
+
+_THROTTLING_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException",
+    "ModelNotReadyException",
+}
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_local = threading.local()
+
+
+class ProviderError(Exception):
+    pass
+
+
+class ProviderDeadlineError(ProviderError):
+    # not a TimeoutError, which is also concurrent.futures.TimeoutError, so a request
+    # failing with it is not taken for one still running, see nlq_executor.py
+    pass
+
+
+@contextlib.contextmanager
+def provider_deadline(seconds):
+    # caps the deadline of the LLM calls made by this thread within the block, e.g. to the
+    # time left of a request, see nlq_executor.py
+    previous = getattr(_local, "deadline", None)
+    deadline = time.monotonic() + seconds
+    _local.deadline = deadline if previous is None else min(previous, deadline)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining_deadline():
+    # seconds left before the deadline set by provider_deadline on this thread, or None,
+    # e.g. to carry it over to another thread
+    deadline = getattr(_local, "deadline", None)
+    return deadline - time.monotonic() if deadline is not None else None
+
+
+def _call_deadline(seconds=PROVIDER_DEADLINE_SECONDS):
+    deadline = time.monotonic() + seconds
+    cap = getattr(_local, "deadline", None)
+    return deadline if cap is None else min(cap, deadline)
+
+
+def _check_deadline(deadline, provider, cause=None):
+    if time.monotonic() < deadline:
+        return
+    _count("deadline_exceeded", provider)
+    raise ProviderDeadlineError(
+        f"No response from {provider} within the deadline (PROVIDER_DEADLINE_SECONDS)."
+    ) from cause
+
+
+def _count(name, provider, value=1):
+    METRICS.incr(f"provider_{name}", value)
+    METRICS.incr(f"provider_{provider}_{name}", value)
+
+
+def is_throttling_error(exc):
+    # a provider still throttling the application after all retries; LangChain wraps some
+    # provider errors, e.g. SagemakerEndpoint raises ValueError, so their causes are checked
+    while exc is not None:
+        response = getattr(exc, "response", None)
+        if isinstance(response, dict):
+            if response.get("Error", {}).get("Code") in _THROTTLING_CODES:
+                return True
+        elif getattr(exc, "status_code", None) == 429:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+# ***** AWS (Amazon Bedrock, Amazon SageMaker) *****
+
+
+def _boto_throttled(response):
+    http_response, parsed = response
+    code = parsed.get("Error", {}).get("Code")
+    return http_response.status_code == 429 or code in _THROTTLING_CODES
+
+
+def _register_boto_hooks(client, provider):
+    events = client.meta.events
+
+    def before_call(context, **kwargs):
+        context["nlq_deadline"] = _call_deadline()
+        _count("calls", provider)
+
+    def needs_retry(request_dict, attempts, response=None, caught_exception=None, **_):
+        # runs after every attempt; botocore decides whether to retry
+        if response is not None:
+            if _boto_throttled(response):
+                _count("throttles", provider)
+            elif response[0].status_code not in _RETRYABLE_STATUS:
+                return None
+        if attempts < PROVIDER_MAX_ATTEMPTS:
+            _check_deadline(
+                request_dict["context"]["nlq_deadline"], provider, caught_exception
+            )
+        return None
+
+    def after_call(parsed, **kwargs):
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if retries:
+            _count("retries", provider, retries)
+
+    events.register("before-call", before_call)
+    events.register_first("needs-retry", needs_retry)
+    events.register("after-call", after_call)
+
+
+def create_boto_client(service_name, region_name):
+    config = Config(
+        region_name=region_name,
+        max_pool_connections=PROVIDER_MAX_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=PROVIDER_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=PROVIDER_READ_TIMEOUT_SECONDS,
+        retries={
+            "mode": PROVIDER_RETRY_MODE,
+            "total_max_attempts": PROVIDER_MAX_ATTEMPTS,
+        },
+    )
+    client = boto3.session.Session().client(service_name, config=config)
+    _register_boto_hooks(client, service_name.replace("-runtime", ""))
+    return client
+
+
+def get_bedrock_client(region_name):
+    # one client per process and region; boto3 clients are thread-safe and pool their
+    # connections
+    return RESOURCES.get(
+        f"bedrock_client_{region_name}",
+        create_boto_client,
+        "bedrock-runtime",
+        region_name,
+    )
+
+
+def get_sagemaker_client(region_name):
+    return RESOURCES.get(
+        f"sagemaker_client_{region_name}",
+        create_boto_client,
+        "sagemaker-runtime",
+        region_name,
+    )
+
+
+# ***** OpenAI *****
+
+
+class ProviderCallHandler(BaseCallbackHandler):
+    # marks the start and end of each LLM call, so the HTTP hooks below can tell retries
+    # apart from new calls; callbacks run in the calling thread
+    def __init__(self, provider):
+        self.provider = provider
+
+    def _start(self, *args, **kwargs):
+        _local.call = {"deadline": _call_deadline(), "attempts": 0}
+        _count("calls", self.provider)
+
+    def _end(self, *args, **kwargs):
+        _local.call = None
+
+    on_llm_start = _start
+    on_chat_model_start = _start
+    on_llm_end = _end
+    on_llm_error = _end
+
+
+def _openai_request(request):
+    call = getattr(_local, "call", None)
+    if call is None:
+        return
+    if call["attempts"]:
+        _count("retries", "openai")
+    call["attempts"] += 1
+    # never wait for a response past the deadline
+    remaining = max(0.001, call["deadline"] - time.monotonic())
+    timeout = dict(request.extensions.get("timeout", {}))
+    for name in ("connect", "read"):
+        timeout[name] = min(timeout.get(name) or remaining, remaining)
+    request.extensions["timeout"] = timeout
+
+
+def _openai_response(response):
+    if response.status_code == 429:
+        _count("throttles", "openai")
+    call = getattr(_local, "call", None)
+    if (
+        call is not None
+        and response.status_code in _RETRYABLE_STATUS
+        and time.monotonic() >= call["deadline"]
+    ):
+        # the OpenAI SDK does not retry responses marked this way
+        response.headers["x-should-retry"] = "false"
+        _count("deadline_exceeded", "openai")
+
+
+def create_openai_http_client():
+    # the OpenAI SDK retries 408, 409, 429 and 5xx responses with jittered exponential
+    # backoff, honoring Retry-After; see create_openai_kwargs
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=PROVIDER_MAX_CONNECTIONS,
+            max_keepalive_connections=PROVIDER_MAX_CONNECTIONS,
+            keepalive_expiry=PROVIDER_KEEPALIVE_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            PROVIDER_READ_TIMEOUT_SECONDS, connect=PROVIDER_CONNECT_TIMEOUT_SECONDS
+        ),
+        event_hooks={"request": [_openai_request], "response": [_openai_response]},
+    )
+
+
+def openai_client_kwargs():
+    # ChatOpenAI arguments sharing one pooled HTTP client per process
+    return {
+        "http_client": RESOURCES.get("openai_http_client", create_openai_http_client),
+        "max_retries": PROVIDER_MAX_ATTEMPTS - 1,
+        "request_timeout": PROVIDER_READ_TIMEOUT_SECONDS,
+        "callbacks": [ProviderCallHandler("openai")],
+    }
@@ -0,0 +1,101 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Cost guard for generated SQL: each query is planned with EXPLAIN (FORMAT JSON) before it runs.
+# Queries estimated to cost too much (e.g. cartesian joins) are rejected. For queries estimated to
+# return many rows, the cost of fetching the first rows is checked, since the application only
+# fetches those, see nlq_db.py. Planner estimates are logged next to actual runtimes.
+
+import json
+import logging
+import os
+
+from sqlalchemy import text
+
+from nlq_metrics import METRICS, emit_emf
+from nlq_sql import is_select, strip_trailing_semicolons
+
+# ***** CONFIGURABLE PARAMETERS *****
+SQL_COST_GUARD_ENABLED = (
+    os.environ.get("SQL_COST_GUARD_ENABLED", "true").lower() == "true"
+)
+# planner cost units, see https://www.postgresql.org/docs/current/runtime-config-query.html
+SQL_MAX_ESTIMATED_COST = float(os.environ.get("SQL_MAX_ESTIMATED_COST", 1000000))
+SQL_MAX_ESTIMATED_ROWS = int(os.environ.get("SQL_MAX_ESTIMATED_ROWS", 10000))
+
+
+class SqlCostError(Exception):
+    pass
+
+
+class SqlCostGuard:
+    def __init__(
+        self,
+        db,
+        max_cost=SQL_MAX_ESTIMATED_COST,
+        max_rows=SQL_MAX_ESTIMATED_ROWS,
+    ):
+        self._db = db
+        self._max_cost = max_cost
+        self._max_rows = max_rows
+
+    def check(self, sql):
+        # planner estimate, or None; raises SqlCostError for statements estimated to cost
+        # more than max_cost. The statement itself is run unchanged, so its result can
+        # still be paged, see nlq_db.py
+        if self._db.dialect != "postgresql" or not is_select(sql):
+            return None
+
+        estimate = self._explain(sql)
+        if estimate["rows"] > self._max_rows:
+            # the server-side cursor only fetches the first max_rows + 1 rows, so that is
+            # the cost that matters, e.g. without a full sort or join of the rest
+            limited = (
+                f"SELECT * FROM (\n{strip_trailing_semicolons(sql)}\n) AS nlq_limited "
+                f"LIMIT {int(self._db.max_rows) + 1}"
+            )
+            estimate = {**self._explain(limited), "limited_from_rows": estimate["rows"]}
+            METRICS.incr("sql_cost_guard_limited")
+
+        if estimate["cost"] > self._max_cost:
+            METRICS.incr("sql_cost_guard_rejected")
+            raise SqlCostError(
+                f"Generated SQL rejected: estimated cost {estimate['cost']:.0f} exceeds "
+                f"the limit of {self._max_cost:.0f} (SQL_MAX_ESTIMATED_COST)."
+            )
+        return estimate
+
+    def _explain(self, sql):
+        with self._db._engine.begin() as connection:
+            if self._db._schema is not None:
+                connection.exec_driver_sql(
+                    "SET search_path TO %s", (self._db._schema,)
+                )
+            plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        return {"cost": root["Total Cost"], "rows": root["Plan Rows"]}
+
+    @staticmethod
+    def record(estimate, seconds, rows):
+        # planner estimate next to the actual runtime, for tuning the limits; rows are
+        # as fetched, so at most SQL_RESULT_MAX_ROWS + 1
+        METRICS.observe("sql_estimated_cost", estimate["cost"])
+        values = {
+            "sql_estimated_cost": estimate["cost"],
+            "sql_estimated_rows": estimate["rows"],
+            "sql_execution_ms": round(seconds * 1000, 3),
+            "sql_fetched_rows": rows,
+        }
+        units = {
+            "sql_estimated_rows": "Count",
+            "sql_execution_ms": "Milliseconds",
+            "sql_fetched_rows": "Count",
+        }
+        emit_emf(values, units, {"Guard": "cost"})
+        logging.info(f"SQL cost estimate vs. actual: {values}")
+
+
+def load_cost_guard(db):
+    if not SQL_COST_GUARD_ENABLED:
+        return None
+    return SqlCostGuard(db)
@@ -0,0 +1,358 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Shared SQLAlchemy engine: one tunable connection pool per process, server-side timeouts
+# applied on every checkout, and pool checkout wait and saturation metrics.
+
+import os
+import time
+from contextlib import contextmanager
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import (
+    Column,
+    ForeignKeyConstraint,
+    MetaData,
+    Table,
+    create_engine,
+    event,
+    inspect,
+    text,
+)
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.types import NullType
+
+from nlq_metrics import METRICS
+from nlq_results import result_text, to_arrow
+from nlq_schema import SchemaCache
+from nlq_sql import has_order_by, is_select, strip_trailing_semicolons
+
+# ***** CONFIGURABLE PARAMETERS *****
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT_SECONDS = int(os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30))
+DB_POOL_RECYCLE_SECONDS = int(os.environ.get("DB_POOL_RECYCLE_SECONDS", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 30000))
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(
+    os.environ.get("DB_IDLE_IN_TRANSACTION_TIMEOUT_MS", 60000)
+)
+# rows of a generated query's result given to the LLM and kept with the answer
+SQL_RESULT_MAX_ROWS = int(os.environ.get("SQL_RESULT_MAX_ROWS", 100))
+# rows per page when browsing larger results in the Details tab
+SQL_PAGE_SIZE = int(os.environ.get("SQL_PAGE_SIZE", 100))
+
+# the given type OIDs that ORDER BY can sort, having a default btree operator class:
+# directly, through a binary-coercible type (e.g. varchar as text), or as arrays, enums
+# and ranges whose element type has one; json, xml and geometric types have none
+_ORDERABLE_TYPES = """
+SELECT t.oid
+FROM pg_type t
+LEFT JOIN pg_type e ON t.typcategory = 'A' AND e.oid = t.typelem
+WHERE t.oid = ANY(CAST(:oids AS oid[])) AND EXISTS (
+    SELECT 1
+    FROM pg_opclass c
+    JOIN pg_am a ON a.oid = c.opcmethod
+    WHERE a.amname = 'btree' AND c.opcdefault AND (
+        c.opcintype = COALESCE(e.oid, t.oid)
+        OR (
+            COALESCE(e.typtype, t.typtype) = 'e'
+            AND c.opcintype = 'anyenum'::regtype::oid
+        )
+        OR (
+            COALESCE(e.typtype, t.typtype) = 'r'
+            AND c.opcintype = 'anyrange'::regtype::oid
+        )
+        OR c.opcintype IN (
+            SELECT k.casttarget
+            FROM pg_cast k
+            WHERE k.castsource = COALESCE(e.oid, t.oid) AND k.castmethod = 'b'
+        )
+    )
+)
+"""
+
+
+def page_order_by(type_codes, orderable):
+    # ORDER BY for paging a subquery aliased nlq_page: the output columns whose type
+    # can be sorted, by ordinal, and if any cannot, the rows' text as a tie-breaker
+    ordinals = [str(i + 1) for i, code in enumerate(type_codes) if code in orderable]
+    if len(ordinals) < len(type_codes):
+        ordinals.append("CAST(nlq_page AS text)")
+    return f" ORDER BY {', '.join(ordinals)}" if ordinals else ""
+
+
+class MeteredQueuePool(QueuePool):
+    # records how long callers wait for a pooled connection
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            METRICS.observe(
+                "db_pool_checkout_wait_seconds", time.perf_counter() - start
+            )
+
+
+def create_db_engine(
+    rds_uri,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+    idle_in_transaction_timeout_ms=DB_IDLE_IN_TRANSACTION_TIMEOUT_MS,
+):
+    engine = create_engine(
+        rds_uri,
+        poolclass=MeteredQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+    )
+
+    if engine.dialect.name == "postgresql":
+        # re-applied on every checkout, so a generated statement cannot disable them
+        # for later users of the same connection
+        timeouts = (
+            f"SET statement_timeout = {int(statement_timeout_ms)}; "
+            f"SET idle_in_transaction_session_timeout = "
+            f"{int(idle_in_transaction_timeout_ms)}"
+        )
+
+        @event.listens_for(engine, "checkout")
+        def set_timeouts(dbapi_connection, connection_record, connection_proxy):
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute(timeouts)
+            finally:
+                cursor.close()
+
+    pool = engine.pool
+    METRICS.gauge("db_pool_size", pool.size)
+    METRICS.gauge("db_pool_checked_out", pool.checkedout)
+    METRICS.gauge(
+        "db_pool_saturation",
+        lambda: pool.checkedout() / max(1, pool_size + max_overflow),
+    )
+
+    return engine
+
+
+class NlqSQLDatabase(SQLDatabase):
+    # SQLDatabase whose table_info is served from a schema snapshot cache, optionally
+    # pruned to selected columns, and whose query results are kept as typed columns and
+    # optionally served from a SQL result cache
+    def __init__(
+        self,
+        engine,
+        result_cache=None,
+        max_rows=SQL_RESULT_MAX_ROWS,
+        page_size=SQL_PAGE_SIZE,
+        **kwargs,
+    ):
+        super().__init__(engine, **kwargs)
+        self.max_rows = max_rows
+        self.page_size = page_size
+        self.schema_cache = SchemaCache(
+            engine,
+            self._schema,
+            render=self._render_table_info,
+            refresh=self.refresh_schema,
+        )
+        self.result_cache = result_cache
+        if result_cache is not None:
+            self.schema_cache.add_listener(result_cache.invalidate_tables)
+
+    def run(self, command, fetch="all", include_columns=False, **kwargs):
+        plain = (
+            isinstance(command, str) and fetch == "all" and not include_columns and not kwargs
+        )
+        if plain:
+            return self.run_query(command)[0]
+        return super().run(command, fetch, include_columns, **kwargs)
+
+    def run_query(self, command):
+        # (result text, as returned by run(), typed result columns as an Arrow table, or
+        # None for statements that return no rows)
+        result = self.cached_result(command)
+        if result is None:
+            result = self.execute_query(command)
+        return result
+
+    def cached_result(self, command):
+        # the result of run_query from the SQL result cache, or None
+        if not self._cacheable(command):
+            return None
+        return self.result_cache.get(command)
+
+    def execute_query(self, command):
+        # run_query without the cache lookup, e.g. after cached_result
+        result = self._run_query(command)
+        if self._cacheable(command):
+            self.result_cache.put(command, self.get_usable_table_names(), result)
+        return result
+
+    def _cacheable(self, command):
+        return self.result_cache is not None and self.result_cache.cacheable(command)
+
+    def _run_query(self, command):
+        columns, rows = self._fetch(command, self.max_rows + 1)
+        if columns is None:
+            return "", None
+        truncated = len(rows) > self.max_rows
+        rows = rows[: self.max_rows]
+        if truncated:
+            METRICS.incr("sql_results_truncated")
+        return (
+            result_text(rows, self._max_string_length, truncated),
+            to_arrow(columns, rows, command, truncated),
+        )
+
+    def fetch_page(self, command, page, page_size=None):
+        # one page of a query's rows, as an Arrow table; the database skips the earlier
+        # pages, so only one page is held at a time
+        page_size = page_size or self.page_size
+        subquery = (
+            f"SELECT * FROM (\n{strip_trailing_semicolons(command)}\n) AS nlq_page"
+        )
+        order_by = ""
+        if not has_order_by(command):
+            # without an ORDER BY, each page's rows can come back in a different order,
+            # so pages would overlap or skip rows; order by the output columns
+            order_by = self._page_order_by(subquery)
+        statement = (
+            f"{subquery}{order_by} "
+            f"LIMIT {int(page_size)} OFFSET {int(page) * int(page_size)}"
+        )
+        columns, rows = self._fetch(statement, page_size)
+        return to_arrow(columns or [], rows)
+
+    def _page_order_by(self, subquery):
+        with self._begin() as connection:
+            cursor = connection.execute(text(f"{subquery} LIMIT 0"))
+            try:
+                type_codes = [column[1] for column in cursor.cursor.description]
+            finally:
+                cursor.close()
+            if self.dialect != "postgresql":
+                # e.g. SQLite, which sorts values of any type
+                return page_order_by(type_codes, set(type_codes))
+            orderable = connection.execute(
+                text(_ORDERABLE_TYPES), {"oids": sorted(set(type_codes))}
+            )
+            return page_order_by(type_codes, set(orderable.scalars()))
+
+    @contextmanager
+    def _begin(self):
+        with self._engine.begin() as connection:
+            if self._schema is not None and self.dialect == "postgresql":
+                connection.exec_driver_sql("SET search_path TO %s", (self._schema,))
+            yield connection
+
+    def _fetch(self, command, max_rows):
+        # (column names, at most max_rows rows), or (None, []) for statements that
+        # return no rows
+        statement = text(command)
+        options = {}
+        if is_select(command):
+            # a named (server-side) cursor for PostgreSQL, so rows beyond max_rows are
+            # never sent to the application
+            statement = statement.columns()
+            options = {"stream_results": True, "max_row_buffer": max_rows}
+        with self._begin() as connection:
+            cursor = connection.execution_options(**options).execute(statement)
+            if not cursor.returns_rows:
+                return None, []
+            try:
+                return list(cursor.keys()), cursor.fetchmany(max_rows)
+            finally:
+                cursor.close()
+
+    def get_table_info(self, table_names=None, table_columns=None):
+        # table_columns optionally limits tables to some of their columns,
+        # see nlq_schema_selector.py
+        return self.schema_cache.get_table_info(table_names, table_columns)
+
+    def _render_table_info(self, table_names=None, table_columns=None):
+        if not table_columns:
+            return super().get_table_info(table_names)
+
+        # same format as SQLDatabase.get_table_info, for copies of the tables that only
+        # have the selected columns
+        table_names = set(table_names or self.get_usable_table_names())
+        metadata = MetaData()
+        tables = []
+        for table in self._metadata.sorted_tables:
+            if table.name not in table_names:
+                continue
+            keep = table_columns.get(table.name)
+            columns = [
+                Column(
+                    column.name,
+                    column.type,
+                    primary_key=column.primary_key,
+                    nullable=column.nullable,
+                )
+                for column in table.columns
+                if (keep is None or column.name in keep)
+                and type(column.type) is not NullType
+            ]
+            tables.append(Table(table.name, metadata, *columns, schema=table.schema))
+
+        # foreign keys whose columns were all kept, on both sides
+        for table in self._metadata.sorted_tables:
+            pruned = metadata.tables.get(table.key)
+            if pruned is None:
+                continue
+            for constraint in table.foreign_key_constraints:
+                referred = metadata.tables.get(constraint.referred_table.key)
+                columns = [element.parent.name for element in constraint.elements]
+                referred_columns = [
+                    element.column.name for element in constraint.elements
+                ]
+                if (
+                    referred is not None
+                    and all(name in pruned.c for name in columns)
+                    and all(name in referred.c for name in referred_columns)
+                ):
+                    pruned.append_constraint(
+                        ForeignKeyConstraint(
+                            columns, [referred.c[name] for name in referred_columns]
+                        )
+                    )
+
+        table_infos = []
+        for table in tables:
+            if self._custom_table_info and table.name in self._custom_table_info:
+                table_infos.append(self._custom_table_info[table.name])
+                continue
+            table_info = str(CreateTable(table).compile(self._engine)).rstrip()
+            has_extra_info = (
+                self._indexes_in_table_info or self._sample_rows_in_table_info
+            )
+            if has_extra_info:
+                table_info += "\n\n/*"
+            if self._indexes_in_table_info:
+                table_info += f"\n{self._get_table_indexes(table)}\n"
+            if self._sample_rows_in_table_info:
+                table_info += f"\n{self._get_sample_rows(table)}\n"
+            if has_extra_info:
+                table_info += "*/"
+            table_infos.append(table_info)
+        table_infos.sort()
+        return "\n\n".join(table_infos)
+
+    def refresh_schema(self):
+        # re-reflect tables and columns after a catalog change
+        self._inspector = inspect(self._engine)
+        self._all_tables = set(self._inspector.get_table_names(schema=self._schema))
+        usable_tables = self.get_usable_table_names()
+        self._usable_tables = set(usable_tables) if usable_tables else self._all_tables
+        metadata = MetaData()
+        metadata.reflect(
+            bind=self._engine, only=list(self._usable_tables), schema=self._schema
+        )
+        self._metadata = metadata
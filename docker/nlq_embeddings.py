@@ -0,0 +1,160 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Pluggable embeddings backends for the short texts the app embeds (questions, few-shot examples,
+# schema descriptions): sentence-transformers on PyTorch, or the same model's ONNX export run
+# with ONNX Runtime, optionally int8-quantized, without torch. Models load on first use, so app
+# startup does not wait for them when the few-shot examples index is prebuilt.
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from nlq_metrics import METRICS
+
+# ***** CONFIGURABLE PARAMETERS *****
+# "huggingface" (sentence-transformers) or "onnx" (ONNX Runtime)
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "huggingface").lower()
+EMBEDDINGS_ONNX_QUANTIZED = (
+    os.environ.get("EMBEDDINGS_ONNX_QUANTIZED", "false").lower() == "true"
+)
+# local paths, or paths in the model's Hugging Face Hub repository
+EMBEDDINGS_ONNX_FILE = os.environ.get("EMBEDDINGS_ONNX_FILE", "onnx/model.onnx")
+EMBEDDINGS_ONNX_QUANTIZED_FILE = os.environ.get(
+    "EMBEDDINGS_ONNX_QUANTIZED_FILE", "onnx/model_quint8_avx2.onnx"
+)
+EMBEDDINGS_ONNX_THREADS = int(os.environ.get("EMBEDDINGS_ONNX_THREADS", 1))
+# all-MiniLM-L6-v2 is trained on up to 256 tokens
+EMBEDDINGS_MAX_TOKENS = int(os.environ.get("EMBEDDINGS_MAX_TOKENS", 256))
+
+
+def _model_file(model_name, filename):
+    if os.path.exists(filename):
+        return filename
+    from huggingface_hub import hf_hub_download
+
+    return hf_hub_download(model_name, filename)
+
+
+class OnnxEmbeddings(Embeddings):
+    # same vectors as sentence-transformers for models with mean pooling and normalization,
+    # such as all-MiniLM-L6-v2
+    def __init__(
+        self,
+        model_name,
+        quantized=EMBEDDINGS_ONNX_QUANTIZED,
+        threads=EMBEDDINGS_ONNX_THREADS,
+        max_tokens=EMBEDDINGS_MAX_TOKENS,
+        batch_size=32,
+    ):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_file = (
+            EMBEDDINGS_ONNX_QUANTIZED_FILE if quantized else EMBEDDINGS_ONNX_FILE
+        )
+        self.model_name = onnx_model_name(model_name, quantized)
+        self._batch_size = batch_size
+
+        self._tokenizer = Tokenizer.from_file(_model_file(model_name, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=max_tokens)
+        self._tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(
+            _model_file(model_name, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self._batch_size):
+            vectors.extend(self._embed(texts[start : start + self._batch_size]))
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        return self._embed([text])[0].tolist()
+
+    def _embed(self, texts):
+        if not texts:
+            return []
+        encodings = self._tokenizer.encode_batch(
+            [text.replace("\n", " ") for text in texts]
+        )
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        inputs = {
+            name: value for name, value in inputs.items() if name in self._input_names
+        }
+        token_vectors = self._session.run(None, inputs)[0]
+
+        # mean of the token vectors, without padding, then unit length
+        mask = attention_mask[:, :, None].astype(np.float32)
+        vectors = (token_vectors * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def onnx_model_name(model_name, quantized):
+    # quantized vectors differ slightly, so they get their own few-shot examples index,
+    # see nlq_examples.py
+    return f"{model_name}:int8" if quantized else model_name
+
+
+class LazyEmbeddings(Embeddings):
+    # builds the embeddings backend on first use
+    def __init__(self, factory, model_name):
+        self.model_name = model_name
+        self._factory = factory
+        self._embeddings = None
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self._load().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._load().embed_query(text)
+
+    def _load(self):
+        embeddings = self._embeddings
+        if embeddings is not None:
+            return embeddings
+        with self._lock:
+            if self._embeddings is None:
+                start = time.perf_counter()
+                self._embeddings = self._factory()
+                load_seconds = time.perf_counter() - start
+                METRICS.observe("embeddings_load_seconds", load_seconds)
+                logging.info(
+                    f"Loaded {self.model_name} embeddings in {load_seconds:.2f}s"
+                )
+            return self._embeddings
+
+
+def create_embeddings(
+    model_name, backend=EMBEDDINGS_BACKEND, quantized=EMBEDDINGS_ONNX_QUANTIZED
+):
+    if backend == "onnx":
+        return LazyEmbeddings(
+            lambda: OnnxEmbeddings(model_name, quantized=quantized),
+            onnx_model_name(model_name, quantized),
+        )
+    if backend != "huggingface":
+        raise ValueError(f"Unknown EMBEDDINGS_BACKEND: {backend}")
+
+    def load():
+        from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(model_name=model_name)
+
+    return LazyEmbeddings(load, model_name)
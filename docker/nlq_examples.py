@@ -0,0 +1,135 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Prebuilt, persisted vector index for the few-shot prompting examples.
+# The index is keyed by a hash of the examples and the embeddings model name, so the examples
+# are embedded once (e.g. at Docker image build time) instead of on every app start.
+# Usage: python nlq_examples.py --examples moma_examples.yaml --index-dir example_index
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+import chromadb
+import numpy as np
+import yaml
+from langchain.prompts.example_selector.semantic_similarity import (
+    SemanticSimilarityExampleSelector,
+)
+from langchain_community.vectorstores import Chroma
+
+from nlq_chain import current_stage
+from nlq_embeddings import create_embeddings
+
+EXAMPLES_FILE = os.environ.get("EXAMPLES_FILE", "moma_examples.yaml")
+EXAMPLES_INDEX_DIR = os.environ.get("EXAMPLES_INDEX_DIR", "example_index")
+HUGGING_FACE_EMBEDDINGS_MODEL = os.environ.get(
+    "HUGGING_FACE_EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+
+
+class TimedExampleSelector(SemanticSimilarityExampleSelector):
+    # embedding the question and searching the index is timed as the example_selection stage
+    def select_examples(self, input_variables):
+        with current_stage("example_selection"):
+            return super().select_examples(input_variables)
+
+
+def embeddings_model_name(embeddings):
+    return getattr(embeddings, "model_name", type(embeddings).__name__)
+
+
+def examples_index_key(examples, model_name):
+    # hash of the parsed examples (insensitive to YAML formatting) and the embeddings model
+    content = json.dumps(examples, sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(f"{model_name}\n{content}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def example_texts(examples):
+    # same text the SemanticSimilarityExampleSelector embeds for each example
+    return [
+        SemanticSimilarityExampleSelector._example_to_text(example, None)
+        for example in examples
+    ]
+
+
+def build_examples_index(examples, embeddings, index_dir=EXAMPLES_INDEX_DIR):
+    key = examples_index_key(examples, embeddings_model_name(embeddings))
+    vectors = np.asarray(
+        embeddings.embed_documents(example_texts(examples)), dtype=np.float32
+    )
+
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        # write to a temporary file, then rename, so readers never see a partial index
+        vectors_path = os.path.join(index_dir, f"{key}.npy")
+        with open(f"{vectors_path}.tmp", "wb") as stream:
+            np.save(stream, vectors)
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        logging.info(f"Wrote few-shot examples index: {vectors_path}")
+    except OSError as e:
+        # e.g. read-only image filesystem; the in-memory vectors are still usable
+        logging.warning(f"Unable to persist few-shot examples index: {e}")
+
+    return key, vectors
+
+
+def load_examples_index(key, index_dir=EXAMPLES_INDEX_DIR):
+    vectors_path = os.path.join(index_dir, f"{key}.npy")
+    if not os.path.exists(vectors_path):
+        return None
+
+    return np.load(vectors_path)
+
+
+def load_example_selector(examples, embeddings, k, index_dir=EXAMPLES_INDEX_DIR):
+    key = examples_index_key(examples, embeddings_model_name(embeddings))
+
+    vectors = load_examples_index(key, index_dir)
+    if vectors is None or len(vectors) != len(examples):
+        logging.info(f"No few-shot examples index for key {key}, embedding examples")
+        key, vectors = build_examples_index(examples, embeddings, index_dir)
+
+    # collection is named by the index key, so a rebuild never mixes in stale examples
+    client = chromadb.EphemeralClient()
+    collection_name = f"nlq_examples_{key}"
+    collection = client.get_or_create_collection(collection_name)
+    collection.upsert(
+        ids=[str(i) for i in range(len(examples))],
+        # Chroma copies the vectors into its in-memory index
+        embeddings=vectors,
+        documents=example_texts(examples),
+        metadatas=examples,
+    )
+
+    vectorstore = Chroma(
+        client=client,
+        collection_name=collection_name,
+        embedding_function=embeddings,
+    )
+
+    return TimedExampleSelector(vectorstore=vectorstore, k=k)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Embed the few-shot prompting examples and persist the index."
+    )
+    parser.add_argument("--examples", default=EXAMPLES_FILE)
+    parser.add_argument("--index-dir", default=EXAMPLES_INDEX_DIR)
+    parser.add_argument("--model", default=HUGGING_FACE_EMBEDDINGS_MODEL)
+    args = parser.parse_args()
+
+    with open(args.examples, "r") as stream:
+        examples = yaml.safe_load(stream)
+
+    # same backend as the apps, see nlq_embeddings.py
+    embeddings = create_embeddings(args.model)
+    key, vectors = build_examples_index(examples, embeddings, args.index_dir)
+    print(f"{len(vectors)} examples embedded, index key: {key}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
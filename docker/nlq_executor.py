@@ -0,0 +1,159 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Bounded worker pool for the NLQ pipeline: a fixed number of workers, a bounded queue with
+# admission control, queue position and wait time per request, cooperative cancellation,
+# and queue depth and saturation metrics.
+
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from nlq_clients import provider_deadline
+from nlq_metrics import METRICS
+from nlq_resources import RESOURCES
+
+# ***** CONFIGURABLE PARAMETERS *****
+NLQ_WORKERS = int(os.environ.get("NLQ_WORKERS", 8))
+NLQ_QUEUE_SIZE = int(os.environ.get("NLQ_QUEUE_SIZE", 32))
+NLQ_REQUEST_TIMEOUT_SECONDS = int(os.environ.get("NLQ_REQUEST_TIMEOUT_SECONDS", 120))
+
+# wrappers carrying the calling thread's context into worker threads, registered by the
+# front end, e.g. the Streamlit session, see nlq_streaming.py
+_THREAD_CONTEXTS = []
+
+
+class ExecutorBusyError(Exception):
+    pass
+
+
+class CancellationHandler(BaseCallbackHandler):
+    # stops a running chain at its next callback (chain, LLM call or token) once cancelled
+    raise_error = True
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _check(self, *args, **kwargs):
+        if self._cancelled.is_set():
+            raise CancelledError("NLQ request cancelled")
+
+    on_chain_start = _check
+    on_llm_start = _check
+    on_chat_model_start = _check
+    on_llm_new_token = _check
+    on_text = _check
+
+
+class NlqTask:
+    def __init__(self, executor):
+        self._executor = executor
+        self._cancel_callbacks = []
+        self.future = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+
+    def queue_position(self):
+        # 1-based position in the queue, 0 once a worker has picked the task up
+        return self._executor.queue_position(self)
+
+    def wait_time(self):
+        # time spent queued, so far
+        return (self.started_at or time.monotonic()) - self.submitted_at
+
+    def elapsed(self):
+        return time.monotonic() - self.submitted_at
+
+    def on_cancel(self, callback):
+        self._cancel_callbacks.append(callback)
+
+    def cancel(self):
+        # a queued task never starts; a running task stops at its next callback
+        if self.future.done():
+            return
+        if not self.future.cancel():
+            for callback in self._cancel_callbacks:
+                callback()
+        METRICS.incr("executor_cancelled")
+
+    def wait(self, timeout=None):
+        # True once the task has finished, whether it succeeded or failed; its error, if
+        # any, is raised by result()
+        wait([self.future], timeout=timeout)
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout=timeout)
+
+
+class NlqExecutor:
+    def __init__(self, workers=NLQ_WORKERS, queue_size=NLQ_QUEUE_SIZE):
+        self._capacity = workers + queue_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nlq")
+        self._lock = threading.Lock()
+        self._queued = []  # tasks waiting for a worker, oldest first
+        self._in_flight = 0
+
+        METRICS.gauge("executor_queue_depth", self.queue_depth)
+        METRICS.gauge("executor_active", lambda: self._in_flight - len(self._queued))
+        METRICS.gauge("executor_saturation", lambda: self._in_flight / self._capacity)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._in_flight >= self._capacity:
+                METRICS.incr("executor_rejected")
+                raise ExecutorBusyError(
+                    "Too many questions in progress, please try again shortly."
+                )
+            self._in_flight += 1
+            task = NlqTask(self)
+            self._queued.append(task)
+
+        task.future = self._pool.submit(self._run, task, fn, args, kwargs)
+        task.future.add_done_callback(lambda _: self._done(task))
+        return task
+
+    def queue_depth(self):
+        return len(self._queued)
+
+    def queue_position(self, task):
+        with self._lock:
+            return self._queued.index(task) + 1 if task in self._queued else 0
+
+    def _run(self, task, fn, args, kwargs):
+        with self._lock:
+            self._queued.remove(task)
+        task.started_at = time.monotonic()
+        METRICS.observe("executor_queue_wait_seconds", task.wait_time())
+        # LLM calls stop retrying once the request has timed out, see nlq_clients.py
+        with provider_deadline(NLQ_REQUEST_TIMEOUT_SECONDS - task.elapsed()):
+            return fn(*args, **kwargs)
+
+    def _done(self, task):
+        with self._lock:
+            self._in_flight -= 1
+            if task in self._queued:
+                # cancelled before a worker picked it up
+                self._queued.remove(task)
+
+
+def register_thread_context(wrapper):
+    if wrapper not in _THREAD_CONTEXTS:
+        _THREAD_CONTEXTS.append(wrapper)
+
+
+def with_thread_context(fn):
+    # fn, to run in another thread with the calling thread's context; fn itself when no
+    # front end registered one, as in the headless API
+    for wrapper in _THREAD_CONTEXTS:
+        fn = wrapper(fn)
+    return fn
+
+
+def get_executor():
+    # one worker pool per process, shared by all user sessions
+    return RESOURCES.get("executor", NlqExecutor, NLQ_WORKERS, NLQ_QUEUE_SIZE)
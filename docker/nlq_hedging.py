@@ -0,0 +1,197 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Hedged SQL generation: when the primary model or endpoint has not answered within a recent
+# latency percentile, the same prompt is sent to a secondary model or endpoint. The first
+# usable SQL wins and the other request is cancelled at its next callback (streamed token), or
+# its response is discarded. Hedge rate, wins and latency saved are reported as metrics.
+
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from nlq_clients import provider_deadline, remaining_deadline
+from nlq_executor import NLQ_WORKERS, CancellationHandler, with_thread_context
+from nlq_metrics import HISTOGRAM_WINDOW, METRICS, percentile
+from nlq_resources import RESOURCES
+
+# ***** CONFIGURABLE PARAMETERS *****
+# the secondary request is sent once the primary takes longer than this percentile of its
+# recent SQL generation latencies
+SQL_HEDGE_PERCENTILE = float(os.environ.get("SQL_HEDGE_PERCENTILE", 95))
+# delay used until SQL_HEDGE_MIN_SAMPLES primary latencies have been seen
+SQL_HEDGE_INITIAL_DELAY_MS = float(os.environ.get("SQL_HEDGE_INITIAL_DELAY_MS", 5000))
+SQL_HEDGE_MIN_DELAY_MS = float(os.environ.get("SQL_HEDGE_MIN_DELAY_MS", 500))
+SQL_HEDGE_MIN_SAMPLES = int(os.environ.get("SQL_HEDGE_MIN_SAMPLES", 20))
+
+
+class _Attempt:
+    # one SQL generation request, run on the hedger's thread pool
+    def __init__(self, name, llm, handlers):
+        self.name = name
+        self.llm = llm
+        self.cancellation = CancellationHandler()
+        # the cancellation handler goes first, so a cancelled request stops streaming
+        self.handlers = [self.cancellation] + handlers
+        self.future = None
+        self.started_at = None
+        self.seconds = None
+        # when the other request won, seconds after the call started
+        self.won_at = None
+
+    def run(self, llm_chain, prompt, stop, deadline):
+        self.started_at = time.perf_counter()
+        limit = provider_deadline(deadline) if deadline is not None else None
+        try:
+            with limit or contextlib.nullcontext():
+                response = self.llm.generate_prompt(
+                    [prompt], stop=stop, callbacks=self.handlers
+                )
+            text = llm_chain.create_outputs(response)[0][llm_chain.output_key]
+            return text, response
+        finally:
+            self.seconds = time.perf_counter() - self.started_at
+
+    def failed(self):
+        return self.future.cancelled() or self.future.exception() is not None
+
+    def usable(self):
+        if not self.future.done() or self.failed():
+            return False
+        return bool(self.future.result()[0].strip())
+
+    def cancel(self):
+        self.cancellation.cancel()
+        self.future.cancel()
+
+
+class SqlHedger:
+    def __init__(
+        self,
+        secondary_llm,
+        pct=SQL_HEDGE_PERCENTILE,
+        initial_delay_ms=SQL_HEDGE_INITIAL_DELAY_MS,
+        min_delay_ms=SQL_HEDGE_MIN_DELAY_MS,
+        min_samples=SQL_HEDGE_MIN_SAMPLES,
+    ):
+        self.secondary_llm = secondary_llm
+        self._pct = pct
+        self._initial_delay = initial_delay_ms / 1000
+        self._min_delay = min_delay_ms / 1000
+        self._min_samples = min_samples
+        self._latencies = deque(maxlen=HISTOGRAM_WINDOW)  # primary, seconds
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedges = 0
+        # up to two requests per worker, plus losers still running
+        self._pool = ThreadPoolExecutor(
+            max_workers=4 * NLQ_WORKERS, thread_name_prefix="nlq-hedge"
+        )
+
+        METRICS.gauge("sql_hedge_delay_seconds", self.delay)
+        METRICS.gauge("sql_hedge_rate", lambda: self._hedges / max(1, self._calls))
+
+    def delay(self):
+        samples = list(self._latencies)
+        if len(samples) < self._min_samples:
+            return self._initial_delay
+        return max(self._min_delay, percentile(samples, self._pct))
+
+    def predict(self, llm_chain, inputs, callbacks, timer):
+        # the prompt, including example selection, is built on this thread and timed as
+        # usual; the requests get the chain's callbacks except the stage timer, which is
+        # given the winning request instead
+        prompts, stop = llm_chain.prep_prompts([inputs])
+        prompt = prompts[0]
+        handlers = [handler for handler in callbacks.handlers if handler is not timer]
+        deadline = remaining_deadline()
+        start = time.perf_counter()
+        with self._lock:
+            self._calls += 1
+
+        primary = self._submit(
+            "primary", llm_chain.llm, handlers, llm_chain, prompt, stop, deadline
+        )
+        primary.future.add_done_callback(lambda _: self._primary_done(primary))
+        attempts = [primary]
+        wait([primary.future], timeout=self.delay())
+
+        if not primary.usable():
+            # slow, failed or empty: the secondary gets the same prompt, without streaming
+            # to the chat
+            with self._lock:
+                self._hedges += 1
+            METRICS.incr("sql_hedge_requests")
+            secondary_handlers = [
+                handler for handler in handlers if isinstance(handler, CancellationHandler)
+            ]
+            secondary = self._submit(
+                "secondary",
+                self.secondary_llm,
+                secondary_handlers,
+                llm_chain,
+                prompt,
+                stop,
+                deadline,
+            )
+            attempts.append(secondary)
+
+        winner = self._first_usable(attempts)
+        won_at = time.perf_counter() - start
+        if winner is not None and winner.name == "secondary":
+            primary.won_at = won_at
+            logging.info(f"Hedged SQL generation won by the secondary in {won_at:.2f}s")
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+        if winner is None:
+            # neither returned usable SQL: raise the primary's error, if any
+            for attempt in attempts:
+                if attempt.failed():
+                    attempt.future.result()
+            return primary.future.result()[0]
+
+        if len(attempts) > 1:
+            METRICS.incr(f"sql_hedge_wins_{winner.name}")
+        text, response = winner.future.result()
+        timer.add_llm_call(won_at, prompt.to_string(), response)
+        return text
+
+    def _submit(self, name, llm, handlers, llm_chain, prompt, stop, deadline):
+        attempt = _Attempt(name, llm, handlers)
+        # streamed tokens can still reach the calling session's placeholders
+        attempt.future = self._pool.submit(
+            with_thread_context(attempt.run), llm_chain, prompt, stop, deadline
+        )
+        return attempt
+
+    @staticmethod
+    def _first_usable(attempts):
+        pending = {attempt.future for attempt in attempts}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in attempts:
+                if attempt.future in done and attempt.usable():
+                    return attempt
+        return None
+
+    def _primary_done(self, primary):
+        if primary.future.cancelled() or primary.seconds is None:
+            return
+        if primary.won_at is not None:
+            # a lower bound when the primary was cancelled before it finished, which is
+            # still kept as a latency sample, so the delay is not skewed toward fast calls
+            saved = max(0.0, primary.seconds - primary.won_at)
+            METRICS.observe("sql_hedge_saved_seconds", saved)
+            self._latencies.append(primary.seconds)
+        elif primary.future.exception() is None:
+            self._latencies.append(primary.seconds)
+
+
+def load_sql_hedger(secondary_llm):
+    # hedging is enabled by configuring a secondary model or endpoint
+    if secondary_llm is None:
+        return None
+    return RESOURCES.get("sql_hedger", SqlHedger, secondary_llm)
@@ -0,0 +1,150 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Minimal in-process metrics: counters, gauges and latency histograms shared by all sessions,
+# exported as Prometheus text and as CloudWatch Embedded Metric Format (EMF) log lines.
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+# ***** CONFIGURABLE PARAMETERS *****
+METRICS_EMF_ENABLED = os.environ.get("METRICS_EMF_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "NLQ")
+
+# number of most recent samples kept per histogram for percentile calculations
+HISTOGRAM_WINDOW = 1024
+
+_PROMETHEUS_INVALID = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Histogram:
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def summary(self):
+        samples = list(self.samples)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "p99": percentile(samples, 99),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        # value may be a number or a zero-argument callable evaluated at snapshot time
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def counter_value(self, name):
+        return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {
+                name: histogram.summary()
+                for name, histogram in self._histograms.items()
+            }
+        gauges = {
+            name: value() if callable(value) else value
+            for name, value in gauges.items()
+        }
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+METRICS = Metrics()
+
+
+def render_prometheus(snapshot, prefix="nlq"):
+    # Prometheus text exposition format; histograms are exported as summaries
+    lines = []
+    for name, value in sorted(snapshot["counters"].items()):
+        name = _PROMETHEUS_INVALID.sub("_", f"{prefix}_{name}_total")
+        lines += [f"# TYPE {name} counter", f"{name} {value}"]
+    for name, value in sorted(snapshot["gauges"].items()):
+        name = _PROMETHEUS_INVALID.sub("_", f"{prefix}_{name}")
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    for name, summary in sorted(snapshot["histograms"].items()):
+        name = _PROMETHEUS_INVALID.sub("_", f"{prefix}_{name}")
+        lines.append(f"# TYPE {name} summary")
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+            lines.append(f'{name}{{quantile="{quantile}"}} {summary[key]}')
+        lines += [f"{name}_sum {summary['sum']}", f"{name}_count {summary['count']}"]
+    return "\n".join(lines) + "\n"
+
+
+def _emf_logger():
+    # EMF records must be complete log events, so they bypass the root logger's format
+    logger = logging.getLogger("nlq.emf")
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def emit_emf(values, units, dimensions, namespace=METRICS_NAMESPACE):
+    # one CloudWatch Embedded Metric Format record; the awslogs driver ships stdout to
+    # CloudWatch Logs, which extracts the metrics from it
+    if not METRICS_EMF_ENABLED or not values:
+        return
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [
+                        {"Name": name, "Unit": units.get(name, "None")}
+                        for name in values
+                    ],
+                }
+            ],
+        },
+        **dimensions,
+        **values,
+    }
+    _emf_logger().info(json.dumps(record))
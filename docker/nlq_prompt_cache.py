@@ -0,0 +1,332 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Amazon Bedrock prompt caching: LangChain's Bedrock LLM sends prompts in the models' legacy
+# text formats, which have no cache points. For models that support prompt caching (Anthropic
+# Claude and Amazon Nova), prompts in cache layout (see nlq_prompts.py) are sent in the model's
+# messages format instead, with a cache point after the static prefix, and the response is
+# handed back in the legacy format. Tokens read from and written to the cache are recorded.
+# OpenAI caches prompt prefixes itself; streamed responses are asked for their token usage,
+# which LangChain does not read, so the cached prompt tokens can be recorded.
+
+import io
+import json
+import logging
+import os
+
+from botocore.exceptions import ClientError
+
+from nlq_chain import record_prompt_cache
+from nlq_clients import get_bedrock_client
+from nlq_prompts import CACHE_POINT
+from nlq_resources import RESOURCES
+
+# ***** CONFIGURABLE PARAMETERS *****
+BEDROCK_PROMPT_CACHING_ENABLED = (
+    os.environ.get("BEDROCK_PROMPT_CACHING_ENABLED", "true").lower() == "true"
+)
+# model IDs containing any of these are sent with cache points; inference profile IDs such as
+# us.anthropic.claude-3-7-sonnet-20250219-v1:0 match too
+BEDROCK_PROMPT_CACHE_MODELS = [
+    model.strip()
+    for model in os.environ.get(
+        "BEDROCK_PROMPT_CACHE_MODELS", "anthropic.claude,amazon.nova"
+    ).split(",")
+    if model.strip()
+]
+
+
+class _AnthropicMessages:
+    # Anthropic Claude: legacy text completions body to Messages API body
+    # https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-anthropic-claude-messages.html
+    parameters = {
+        "max_tokens_to_sample": "max_tokens",
+        "temperature": "temperature",
+        "top_p": "top_p",
+        "topP": "top_p",
+        "top_k": "top_k",
+        "stop_sequences": "stop_sequences",
+    }
+
+    @staticmethod
+    def prompt(body):
+        prompt = body.get("prompt")
+        if not isinstance(prompt, str):
+            return None
+        prompt = prompt.strip()
+        if prompt.startswith("Human:"):
+            prompt = prompt[len("Human:") :]
+        if prompt.endswith("Assistant:"):
+            prompt = prompt[: -len("Assistant:")]
+        return prompt.strip()
+
+    @classmethod
+    def request(cls, body, static, dynamic, cache_point):
+        static_block = {"type": "text", "text": static}
+        if cache_point:
+            static_block["cache_control"] = {"type": "ephemeral"}
+        request = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 256,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [static_block, {"type": "text", "text": dynamic}],
+                }
+            ],
+        }
+        for name, value in body.items():
+            if name in cls.parameters:
+                request[cls.parameters[name]] = value
+        return request
+
+    @staticmethod
+    def response(body):
+        # (text, (cache read tokens, cache write tokens))
+        text = "".join(
+            block.get("text", "")
+            for block in body.get("content", [])
+            if block.get("type") == "text"
+        )
+        return text, _anthropic_usage(body.get("usage"))
+
+    @staticmethod
+    def chunk(event):
+        # (text, usage) of a streamed event, either can be None
+        if event.get("type") == "message_start":
+            return None, _anthropic_usage(event.get("message", {}).get("usage"))
+        if event.get("type") == "content_block_delta":
+            return event.get("delta", {}).get("text"), None
+        return None, None
+
+    @staticmethod
+    def legacy(text):
+        return {"completion": text}
+
+    legacy_chunk = legacy
+
+
+def _anthropic_usage(usage):
+    if not usage:
+        return None
+    return (
+        usage.get("cache_read_input_tokens") or 0,
+        usage.get("cache_creation_input_tokens") or 0,
+    )
+
+
+class _NovaMessages:
+    # Amazon Nova: legacy Amazon Titan body to messages-v1 body
+    # https://docs.aws.amazon.com/nova/latest/userguide/prompt-caching.html
+    parameters = {
+        "maxTokenCount": "maxTokens",
+        "temperature": "temperature",
+        "topP": "topP",
+        "stopSequences": "stopSequences",
+    }
+
+    @staticmethod
+    def prompt(body):
+        prompt = body.get("inputText")
+        return prompt if isinstance(prompt, str) else None
+
+    @classmethod
+    def request(cls, body, static, dynamic, cache_point):
+        content = [{"text": static}]
+        if cache_point:
+            content.append({"cachePoint": {"type": "default"}})
+        content.append({"text": dynamic})
+        config = body.get("textGenerationConfig") or {}
+        return {
+            "schemaVersion": "messages-v1",
+            "messages": [{"role": "user", "content": content}],
+            "inferenceConfig": {
+                cls.parameters[name]: value
+                for name, value in config.items()
+                if name in cls.parameters
+            },
+        }
+
+    @staticmethod
+    def response(body):
+        content = body.get("output", {}).get("message", {}).get("content", [])
+        text = "".join(block.get("text", "") for block in content)
+        return text, _nova_usage(body.get("usage"))
+
+    @staticmethod
+    def chunk(event):
+        if "contentBlockDelta" in event:
+            return event["contentBlockDelta"].get("delta", {}).get("text"), None
+        if "metadata" in event:
+            return None, _nova_usage(event["metadata"].get("usage"))
+        return None, None
+
+    @staticmethod
+    def legacy(text):
+        return {"results": [{"outputText": text}]}
+
+    @staticmethod
+    def legacy_chunk(text):
+        return {"outputText": text}
+
+
+def _nova_usage(usage):
+    if not usage:
+        return None
+    return (
+        usage.get("cacheReadInputTokenCount") or 0,
+        usage.get("cacheWriteInputTokenCount") or 0,
+    )
+
+
+class BedrockPromptCache:
+    # stands in for the bedrock-runtime client of the Bedrock LLM; prompts without a cache
+    # point, and other models, go to the client unchanged
+    def __init__(self, client, models=BEDROCK_PROMPT_CACHE_MODELS):
+        self._client = client
+        self._models = models
+        self._unsupported = set()  # models that rejected a cache point
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def invoke_model(self, **kwargs):
+        request = self._parse(kwargs)
+        if request is None:
+            return self._client.invoke_model(**kwargs)
+        messages, body, static, dynamic = request
+
+        response, cache_point = self._invoke(
+            self._client.invoke_model, kwargs, messages, body, static, dynamic
+        )
+        text, usage = messages.response(json.loads(response["body"].read()))
+        if cache_point and usage is not None:
+            record_prompt_cache(*usage)
+        legacy = json.dumps(messages.legacy(text)).encode("utf-8")
+        return {**response, "body": io.BytesIO(legacy)}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        request = self._parse(kwargs)
+        if request is None:
+            return self._client.invoke_model_with_response_stream(**kwargs)
+        messages, body, static, dynamic = request
+
+        response, cache_point = self._invoke(
+            self._client.invoke_model_with_response_stream,
+            kwargs,
+            messages,
+            body,
+            static,
+            dynamic,
+        )
+        events = self._stream(response["body"], messages, cache_point)
+        return {**response, "body": events}
+
+    def _parse(self, kwargs):
+        # (messages format, legacy body, static prompt, dynamic prompt), or None for
+        # prompts without a cache point and models without prompt caching
+        model_id = kwargs.get("modelId") or ""
+        if not any(model in model_id for model in self._models):
+            return None
+        if "anthropic" in model_id:
+            messages = _AnthropicMessages
+        elif "nova" in model_id:
+            messages = _NovaMessages
+        else:
+            return None
+        try:
+            body = json.loads(kwargs["body"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not isinstance(body, dict):
+            return None
+        prompt = messages.prompt(body)
+        if prompt is None or CACHE_POINT not in prompt:
+            return None
+        index = prompt.index(CACHE_POINT)
+        return messages, body, prompt[:index].rstrip(), prompt[index:]
+
+    def _invoke(self, method, kwargs, messages, body, static, dynamic):
+        # (response, whether the request had a cache point)
+        model_id = kwargs["modelId"]
+        cache_point = model_id not in self._unsupported
+        request = messages.request(body, static, dynamic, cache_point)
+        try:
+            return method(**{**kwargs, "body": json.dumps(request)}), cache_point
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if not cache_point or code != "ValidationException":
+                raise
+            # e.g. a model version without prompt caching
+            logging.warning(f"{model_id} rejected a cache point, not caching: {e}")
+            self._unsupported.add(model_id)
+        request = messages.request(body, static, dynamic, False)
+        return method(**{**kwargs, "body": json.dumps(request)}), False
+
+    @staticmethod
+    def _stream(stream, messages, cache_point):
+        # the streamed events in the legacy format, for the Bedrock LLM
+        for event in stream:
+            chunk = event.get("chunk")
+            if not chunk:
+                yield event
+                continue
+            text, usage = messages.chunk(json.loads(chunk["bytes"]))
+            if cache_point and usage is not None:
+                record_prompt_cache(*usage)
+            if text:
+                legacy = json.dumps(messages.legacy_chunk(text)).encode("utf-8")
+                yield {"chunk": {"bytes": legacy}}
+
+
+class OpenAIStreamUsage:
+    # stands in for the chat completions client of ChatOpenAI; non-streamed responses
+    # report their usage to the stage timer already, see nlq_chain.py
+    def __init__(self, completions):
+        self._completions = completions
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+    def create(self, **kwargs):
+        if not kwargs.get("stream"):
+            return self._completions.create(**kwargs)
+        # a last chunk with the usage and no choices, which LangChain skips; passed as
+        # extra_body, as the pinned openai package has no stream_options argument
+        extra_body = {
+            **(kwargs.get("extra_body") or {}),
+            "stream_options": {"include_usage": True},
+        }
+        stream = self._completions.create(**{**kwargs, "extra_body": extra_body})
+        return self._stream(stream)
+
+    @staticmethod
+    def _stream(stream):
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None and not isinstance(usage, dict):
+                    usage = usage.model_dump()
+                if usage:
+                    details = usage.get("prompt_tokens_details") or {}
+                    if details.get("cached_tokens") is not None:
+                        record_prompt_cache(details["cached_tokens"])
+                yield chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+
+def with_openai_stream_usage(llm):
+    # ChatOpenAI whose streamed calls record cached prompt tokens
+    llm.client = OpenAIStreamUsage(llm.client)
+    return llm
+
+
+def get_bedrock_prompt_cache(region_name):
+    # the shared bedrock-runtime client, sending cache points to models that support them
+    client = get_bedrock_client(region_name)
+    if not BEDROCK_PROMPT_CACHING_ENABLED:
+        return client
+    return RESOURCES.get(
+        f"bedrock_prompt_cache_{region_name}", BedrockPromptCache, client
+    )
@@ -0,0 +1,139 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Compact few-shot prompt: each example's table_info repeats CREATE TABLE statements and sample
+# rows that are usually already in the live table_info at the end of the prompt. In compact mode
+# the tables are only described by the live table_info, and the examples name their tables.
+# With a prompt budget, the number of examples is fitted to the provider's token budget. In
+# cache layout, the static parts (instructions, a fixed core of examples and the tables) come
+# first and the selected examples and the question last, so providers can cache the prefix.
+
+import os
+import re
+from typing import Any, List, Optional
+
+from langchain.prompts import FewShotPromptTemplate
+from langchain_core.prompts.string import DEFAULT_FORMATTER_MAPPING
+
+from nlq_budget import PROMPT_EXAMPLE_RESULT_CHARS
+from nlq_chain import estimate_tokens, record_tokens
+
+# ***** CONFIGURABLE PARAMETERS *****
+COMPACT_PROMPT = os.environ.get("COMPACT_PROMPT", "true").lower() == "true"
+PROMPT_CACHE_LAYOUT = os.environ.get("PROMPT_CACHE_LAYOUT", "false").lower() == "true"
+# examples always in the prompt, at the start of moma_examples.yaml, in cache layout
+PROMPT_CACHE_CORE_EXAMPLES = int(os.environ.get("PROMPT_CACHE_CORE_EXAMPLES", 2))
+
+# in cache layout, the prompt up to this line is the same for every question (as long as the
+# tables are), and is cached by the provider, see nlq_prompt_cache.py
+CACHE_POINT = "Here are more examples, similar to the question:"
+
+_CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(?:"?\w+"?\.)?"?(\w+)"?', re.I)
+
+
+def table_sections(table_info):
+    # {table name: CREATE TABLE statement and sample rows}, in order of appearance
+    matches = list(_CREATE_TABLE.finditer(table_info or ""))
+    sections = {}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match else len(table_info)
+        sections.setdefault(
+            match.group(1).lower(), table_info[match.start() : end].strip()
+        )
+    return sections
+
+
+class CompactFewShotPromptTemplate(FewShotPromptTemplate):
+    # same prompt as FewShotPromptTemplate when compact and cache_layout are False and there
+    # is no budget
+    compact: bool = COMPACT_PROMPT
+    cache_layout: bool = PROMPT_CACHE_LAYOUT
+    # examples placed before the cache point in cache layout, whatever the question
+    core_examples: List[dict] = []
+    # fits the number of examples to the provider's token budget, see nlq_budget.py
+    prompt_budget: Optional[Any] = None
+    # characters kept of an example's SQL result when the budget truncates examples
+    result_chars: int = PROMPT_EXAMPLE_RESULT_CHARS
+
+    def format(self, **kwargs):
+        has_table_info = "table_info" in self.example_prompt.input_variables
+        if (
+            (not self.compact or not has_table_info)
+            and self.prompt_budget is None
+            and not self.cache_layout
+        ):
+            return super().format(**kwargs)
+
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        examples = [
+            {k: e[k] for k in self.example_prompt.input_variables}
+            for e in self._get_examples(**kwargs)
+        ]
+        core_strings = []
+        if self.cache_layout:
+            core = [
+                {k: e[k] for k in self.example_prompt.input_variables}
+                for e in self.core_examples
+            ]
+            examples = [example for example in examples if example not in core]
+            core_strings = [
+                self.example_prompt.format(
+                    **(self._compact(example) if self.compact else example)
+                )
+                for example in core
+            ]
+        full_strings = [self.example_prompt.format(**example) for example in examples]
+        # the examples only name their tables; the live table_info describes the tables
+        # the question may use, even when examples use others (e.g. after schema pruning)
+        compact_strings = [
+            self.example_prompt.format(**self._compact(example)) for example in examples
+        ]
+        example_strings = compact_strings if self.compact else full_strings
+
+        if self.compact and has_table_info:
+            # prompt tokens saved compared with repeating every example's table_info
+            full_tokens = sum(estimate_tokens(text) for text in full_strings)
+            compact_tokens = sum(estimate_tokens(text) for text in compact_strings)
+            record_tokens("compact_prompt_saved", max(0, full_tokens - compact_tokens))
+
+        if self.prompt_budget is not None:
+            truncated_strings = [
+                self.example_prompt.format(**self._truncate(self._compact(example)))
+                for example in examples
+            ]
+            # the core examples are always kept
+            base = self._render([], kwargs, core_strings)
+            k, truncated, _ = self.prompt_budget.fit(
+                base, list(zip(example_strings, truncated_strings))
+            )
+            example_strings = (truncated_strings if truncated else example_strings)[:k]
+
+        return self._render(example_strings, kwargs, core_strings)
+
+    def _render(self, example_strings, kwargs, core_strings=()):
+        if self.cache_layout:
+            # the suffix's last paragraph, the question, goes after the selected examples
+            tables, _, question = self.suffix.rpartition("\n\n")
+            pieces = [
+                self.prefix,
+                *core_strings,
+                tables,
+                CACHE_POINT,
+                *example_strings,
+                question,
+            ]
+        else:
+            pieces = [self.prefix, *example_strings, self.suffix]
+        template = self.example_separator.join([piece for piece in pieces if piece])
+        return DEFAULT_FORMATTER_MAPPING[self.template_format](template, **kwargs)
+
+    @staticmethod
+    def _compact(example):
+        sections = table_sections(example.get("table_info"))
+        if not sections:
+            return example
+        return {**example, "table_info": f"Tables: {', '.join(sections)}"}
+
+    def _truncate(self, example):
+        result = example.get("sql_result")
+        if not isinstance(result, str) or len(result) <= self.result_chars:
+            return example
+        return {**example, "sql_result": result[: self.result_chars] + "..."}
@@ -0,0 +1,70 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Process-wide registry for expensive resources (LLM clients, SQLDatabase, embeddings, chains).
+# Streamlit re-executes the app script on every widget interaction, but imported modules stay
+# loaded, so resources held here are built once per process and shared by all user sessions.
+
+import logging
+import threading
+
+_PRIMITIVE_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+def _config_key(value):
+    # primitives (and containers of primitives) compare by value, anything else by identity,
+    # so a chain is rebuilt when the llm or db instance it was built from is replaced; the
+    # registry entry holds the arguments, so their ids are not reused while it lives
+    if isinstance(value, _PRIMITIVE_TYPES):
+        return value
+    if isinstance(value, (tuple, list)):
+        return tuple(_config_key(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _config_key(v)) for k, v in value.items()))
+    return ("id", id(value))
+
+
+class ResourceRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._resources = {}
+
+    def get(self, name, factory, *args, **kwargs):
+        # return the named resource, building it with factory(*args, **kwargs) on first use
+        # or when the configuration (args and kwargs) differs from the one it was built with
+        config = _config_key((args, kwargs))
+
+        entry = self._resources.get(name)
+        if entry is not None and entry[0] == config:
+            return entry[1]
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        # one builder per resource; concurrent sessions wait for it instead of building duplicates
+        with key_lock:
+            entry = self._resources.get(name)
+            if entry is not None and entry[0] == config:
+                return entry[1]
+            if entry is not None:
+                logging.info(f"Configuration changed, rebuilding resource: {name}")
+            else:
+                logging.info(f"Building resource: {name}")
+            resource = factory(*args, **kwargs)
+            self._resources[name] = (config, resource, (args, kwargs))
+            return resource
+
+    def peek(self, name):
+        # return the named resource if it has been built, without building it
+        entry = self._resources.get(name)
+        return entry[1] if entry is not None else None
+
+    def invalidate(self, name=None):
+        # drop one resource (or all of them); the next get() rebuilds it
+        with self._lock:
+            if name is None:
+                self._resources.clear()
+            else:
+                self._resources.pop(name, None)
+
+
+RESOURCES = ResourceRegistry()
@@ -0,0 +1,80 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Typed query results: the rows of a generated query are kept as Arrow columns next to the text
+# sent to the LLM, so the Details tab and the API use the typed values (Decimal, datetime, ...)
+# instead of parsing the text back into Python objects. Results are capped, and larger results
+# are paged from the database.
+
+import pyarrow as pa
+from langchain_community.utilities.sql_database import truncate_word
+
+
+def result_text(rows, max_string_length, truncated=False):
+    # same text as SQLDatabase.run, for the answer prompt
+    if not rows:
+        return ""
+    text = str(
+        [
+            tuple(truncate_word(value, length=max_string_length) for value in row)
+            for row in rows
+        ]
+    )
+    if truncated:
+        text += f" (first {len(rows)} rows only)"
+    return text
+
+
+def _column_array(values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # mixed or unsupported types in one column, e.g. in SQLite or for JSON values
+        return pa.array(
+            [None if value is None else str(value) for value in values],
+            type=pa.string(),
+        )
+
+
+def to_arrow(columns, rows, sql=None, truncated=False):
+    # one Arrow array per result column, built straight from the cursor rows; the query
+    # and whether rows were left out are kept in the schema metadata, for paging
+    values = zip(*rows) if rows else [[] for _ in columns]
+    metadata = {"truncated": "true" if truncated else "false"}
+    if sql is not None:
+        metadata["sql"] = sql
+    return pa.Table.from_arrays(
+        [_column_array(list(column)) for column in values],
+        names=list(columns),
+        metadata=metadata,
+    )
+
+
+def _metadata(table, key):
+    metadata = (table.schema.metadata or {}) if table is not None else {}
+    value = metadata.get(key.encode())
+    return value.decode() if value is not None else None
+
+
+def result_sql(table):
+    return _metadata(table, "sql")
+
+
+def is_truncated(table):
+    # True when the query returned more rows than were fetched, see nlq_db.py
+    return _metadata(table, "truncated") == "true"
+
+
+def table_nbytes(table):
+    return table.nbytes if table is not None else 0
+
+
+def to_dataframe(table):
+    # numeric columns without nulls are wrapped without copying
+    return table.to_pandas(split_blocks=True)
+
+
+def table_rows(table):
+    # rows as lists, for JSON responses
+    if table is None:
+        return []
+    columns = [column.to_pylist() for column in table.columns]
+    return [list(row) for row in zip(*columns)]
@@ -0,0 +1,186 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Schema snapshot cache: table_info (CREATE TABLE text plus sample rows) is rendered once and
+# reused until the database catalog actually changes. Changes are detected by a cheap catalog
+# signature query, a PostgreSQL NOTIFY (e.g. from a DDL event trigger), or an explicit invalidate().
+# Listeners (e.g. the SQL result cache) are told which tables changed.
+
+import logging
+import os
+import select
+import threading
+import time
+
+from sqlalchemy import text
+
+from nlq_metrics import METRICS
+
+# ***** CONFIGURABLE PARAMETERS *****
+SCHEMA_CHECK_INTERVAL_SECONDS = int(
+    os.environ.get("SCHEMA_CHECK_INTERVAL_SECONDS", 60)
+)
+# empty value disables the LISTEN/NOTIFY invalidation channel
+SCHEMA_NOTIFY_CHANNEL = os.environ.get("SCHEMA_NOTIFY_CHANNEL", "nlq_schema_changed")
+
+# maximum rendered table_info variants kept (whole schema, and per pruned selection)
+SCHEMA_CACHE_MAX_SNAPSHOTS = 256
+
+# DDL state only: relfilenode changes on table rewrites (e.g. TRUNCATE, ALTER COLUMN TYPE) and
+# the column digest on any column change. Row changes do not re-reflect the schema; cached SQL
+# results and answers expire after their TTL, see nlq_cache.py
+_POSTGRES_SIGNATURE_SQL = text(
+    """
+    SELECT c.relname,
+           c.relfilenode,
+           md5(string_agg(a.attname || ':' || format_type(a.atttypid, a.atttypmod)
+                          || ':' || a.attnotnull::text, ',' ORDER BY a.attnum))
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = coalesce(:schema, current_schema())
+      AND c.relkind IN ('r', 'p', 'v', 'm')
+    GROUP BY c.relname, c.relfilenode
+    ORDER BY c.relname
+    """
+)
+
+
+class SchemaCache:
+    def __init__(
+        self,
+        engine,
+        schema,
+        render,
+        refresh,
+        check_interval=SCHEMA_CHECK_INTERVAL_SECONDS,
+        notify_channel=SCHEMA_NOTIFY_CHANNEL,
+    ):
+        # render(table_names, table_columns) builds table_info uncached;
+        # refresh() re-reflects the schema
+        self._engine = engine
+        self._schema = schema
+        self._render = render
+        self._refresh = refresh
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._stale = False
+        self._listeners = []
+
+        if notify_channel and engine.dialect.name == "postgresql":
+            threading.Thread(
+                target=self._listen, args=(notify_channel,), daemon=True
+            ).start()
+
+    def get_table_info(self, table_names=None, table_columns=None):
+        # table_columns optionally limits tables to some of their columns, see
+        # nlq_schema_selector.py
+        self._check()
+
+        key = (
+            None if table_names is None else tuple(sorted(table_names)),
+            None
+            if not table_columns
+            else tuple(
+                sorted((table, tuple(sorted(c))) for table, c in table_columns.items())
+            ),
+        )
+        table_info = self._snapshots.get(key)
+        if table_info is not None:
+            METRICS.incr("schema_cache_hits")
+            return table_info
+
+        with self._lock:
+            table_info = self._snapshots.get(key)
+            if table_info is None:
+                METRICS.incr("schema_cache_misses")
+                table_info = self._render(table_names, table_columns)
+                self._snapshots[key] = table_info
+                while len(self._snapshots) > SCHEMA_CACHE_MAX_SNAPSHOTS:
+                    # pruned schemas can differ per question; drop the oldest
+                    self._snapshots.pop(next(iter(self._snapshots)))
+        return table_info
+
+    def add_listener(self, listener):
+        # listener(tables) is called with the changed table names, or None for all tables
+        self._listeners.append(listener)
+
+    def invalidate(self):
+        # explicit admin trigger; the next get_table_info() re-reflects and re-renders
+        self._stale = True
+
+    def _check_due(self):
+        elapsed = time.monotonic() - self._checked_at
+        return self._stale or elapsed >= self._check_interval
+
+    def _check(self):
+        if not self._check_due():
+            return
+
+        with self._lock:
+            if not self._check_due():
+                return
+            self._checked_at = time.monotonic()
+            signature = self._read_signature()
+            changed = self._signature is not None and signature != self._signature
+            if self._stale or changed:
+                logging.info("Database catalog changed, refreshing schema snapshot")
+                METRICS.incr("schema_cache_invalidations")
+                self._refresh()
+                self._snapshots.clear()
+                tables = self._changed_tables(self._signature, signature)
+                for listener in self._listeners:
+                    listener(tables)
+            self._signature = signature
+            self._stale = False
+
+    @staticmethod
+    def _changed_tables(old, new):
+        # table-level signatures (PostgreSQL) narrow the change down to individual tables
+        if not isinstance(old, dict) or not isinstance(new, dict):
+            return None
+        tables = {
+            table
+            for table in old.keys() | new.keys()
+            if old.get(table) != new.get(table)
+        }
+        return tables or None
+
+    def _read_signature(self):
+        dialect = self._engine.dialect.name
+        with self._engine.connect() as connection:
+            if dialect == "postgresql":
+                rows = connection.execute(
+                    _POSTGRES_SIGNATURE_SQL, {"schema": self._schema}
+                )
+                return {row[0]: tuple(row[1:]) for row in rows}
+            if dialect == "sqlite":
+                return connection.exec_driver_sql("PRAGMA schema_version").scalar()
+        # no catalog signature for other dialects; rely on explicit invalidation
+        return None
+
+    def _listen(self, channel):
+        # dedicated connection, outside the pool, waiting for NOTIFY <channel>
+        while True:
+            connection = None
+            try:
+                connection = self._engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.rollback()
+                dbapi_connection.autocommit = True
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f'LISTEN "{channel}"')
+                while True:
+                    if select.select([dbapi_connection], [], [], 60) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    if dbapi_connection.notifies:
+                        dbapi_connection.notifies.clear()
+                        self.invalidate()
+            except Exception as e:
+                logging.warning(f"Schema change listener failed, retrying: {e}")
+                if connection is not None:
+                    connection.close()
+                time.sleep(30)
@@ -0,0 +1,168 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Question-aware schema pruning: table and column descriptions are embedded once per schema
+# version, and each question's table_info only describes the best-matching tables and columns,
+# plus the tables their foreign keys join to. Keeps the prompt size bounded as the database grows.
+
+import logging
+import os
+import threading
+
+import numpy as np
+
+from nlq_metrics import METRICS
+
+# ***** CONFIGURABLE PARAMETERS *****
+SCHEMA_PRUNING_ENABLED = (
+    os.environ.get("SCHEMA_PRUNING_ENABLED", "true").lower() == "true"
+)
+# schemas within both limits are sent in full, without embedding the question
+SCHEMA_PRUNING_MAX_TABLES = int(os.environ.get("SCHEMA_PRUNING_MAX_TABLES", 5))
+SCHEMA_PRUNING_MAX_COLUMNS = int(os.environ.get("SCHEMA_PRUNING_MAX_COLUMNS", 25))
+
+
+def _words(name):
+    return name.replace("_", " ")
+
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class SchemaSelector:
+    def __init__(
+        self,
+        db,
+        embeddings,
+        max_tables=SCHEMA_PRUNING_MAX_TABLES,
+        max_columns=SCHEMA_PRUNING_MAX_COLUMNS,
+    ):
+        self._db = db
+        self._embeddings = embeddings
+        self._max_tables = max_tables
+        self._max_columns = max_columns
+        self._lock = threading.Lock()
+        self._index = None
+
+        # descriptions are rebuilt after a catalog change, see nlq_schema.py
+        db.schema_cache.add_listener(self.invalidate)
+
+    def invalidate(self, tables=None):
+        self._index = None
+
+    def select(self, question):
+        # (table names, {table name: column names}) for the question, or (None, None) to
+        # send the whole schema
+        index = self._load_index()
+        if not index["prune"]:
+            return None, None
+
+        question_vector = _unit(self._embeddings.embed_query(question.strip()))
+
+        # a table scores as well as its description or its best-matching column
+        column_scores = index["column_vectors"] @ question_vector
+        table_scores = index["table_vectors"] @ question_vector
+        np.maximum.at(table_scores, index["column_positions"], column_scores)
+
+        ranked = [index["tables"][i] for i in np.argsort(-table_scores)]
+        selected = ranked[: self._max_tables]
+        tables = self._foreign_key_closure(selected, index["references"])
+
+        table_columns = {}
+        for table in tables:
+            keys = index["key_columns"][table]
+            scored = [
+                (column_scores[i], index["column_names"][i])
+                for i, column_table in enumerate(index["column_tables"])
+                if column_table == table and index["column_names"][i] not in keys
+            ]
+            if len(scored) + len(keys) <= self._max_columns:
+                continue
+            top = sorted(scored, reverse=True)[: max(0, self._max_columns - len(keys))]
+            table_columns[table] = keys | {name for _, name in top}
+
+        METRICS.observe("schema_selected_tables", len(tables))
+        logging.info(f"Schema selected for question: {sorted(tables)}")
+        return sorted(tables), table_columns or None
+
+    @staticmethod
+    def _foreign_key_closure(selected, references):
+        # add the tables the selected tables reference, and link tables that reference
+        # two or more selected tables, so the joins between them are still described
+        tables = set(selected)
+        for table in selected:
+            tables |= references.get(table, set())
+        for table, referenced in references.items():
+            if len(referenced & set(selected)) >= 2:
+                tables.add(table)
+        return tables
+
+    def _load_index(self):
+        index = self._index
+        if index is not None:
+            return index
+        with self._lock:
+            if self._index is None:
+                self._index = self._build_index()
+            return self._index
+
+    def _build_index(self):
+        db_tables = {
+            table.name: table
+            for table in self._db._metadata.sorted_tables
+            if table.name in set(self._db.get_usable_table_names())
+        }
+        prune = len(db_tables) > self._max_tables or any(
+            len(table.columns) > self._max_columns for table in db_tables.values()
+        )
+        index = {"prune": prune}
+        if not prune:
+            return index
+
+        tables = list(db_tables)
+        column_tables, column_names, column_texts = [], [], []
+        table_texts, key_columns, references = [], {}, {}
+        for name, table in db_tables.items():
+            table_texts.append(
+                f"table {_words(name)}"
+                + (f": {table.comment}" if table.comment else "")
+                + f", columns {', '.join(_words(c.name) for c in table.columns)}"
+            )
+            key_columns[name] = {
+                column.name
+                for column in table.columns
+                if column.primary_key or column.foreign_keys
+            }
+            references[name] = {
+                fk.column.table.name
+                for fk in table.foreign_keys
+                if fk.column.table.name in db_tables and fk.column.table.name != name
+            }
+            for column in table.columns:
+                column_tables.append(name)
+                column_names.append(column.name)
+                column_texts.append(
+                    f"{_words(name)} {_words(column.name)}"
+                    + (f": {column.comment}" if column.comment else "")
+                )
+
+        vectors = _unit(self._embeddings.embed_documents(table_texts + column_texts))
+        METRICS.incr("schema_selector_index_builds")
+        index.update(
+            tables=tables,
+            table_vectors=vectors[: len(tables)],
+            column_tables=column_tables,
+            column_positions=np.array([tables.index(t) for t in column_tables]),
+            column_names=column_names,
+            column_vectors=vectors[len(tables) :],
+            key_columns=key_columns,
+            references=references,
+        )
+        return index
+
+
+def load_schema_selector(db, embeddings):
+    if not SCHEMA_PRUNING_ENABLED:
+        return None
+    return SchemaSelector(db, embeddings)
@@ -0,0 +1,150 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# TTL cache for AWS Secrets Manager secrets, with background refresh ahead of expiry,
+# a SQLAlchemy hook that re-reads the database credentials when a login is rejected
+# because the password was rotated, and the same for the OpenAI API key.
+
+import logging
+import os
+import threading
+import time
+
+import boto3
+from sqlalchemy import event
+
+from nlq_resources import RESOURCES
+
+# ***** CONFIGURABLE PARAMETERS *****
+SECRETS_TTL_SECONDS = int(os.environ.get("SECRETS_TTL_SECONDS", 3600))
+# fraction of the TTL after which a cached secret is refreshed in the background
+SECRETS_REFRESH_RATIO = float(os.environ.get("SECRETS_REFRESH_RATIO", 0.8))
+
+
+class SecretCache:
+    def __init__(
+        self,
+        region_name,
+        ttl=SECRETS_TTL_SECONDS,
+        refresh_ratio=SECRETS_REFRESH_RATIO,
+    ):
+        session = boto3.session.Session()
+        self._client = session.client(
+            service_name="secretsmanager", region_name=region_name
+        )
+        self._ttl = ttl
+        self._refresh_after = ttl * refresh_ratio
+        self._lock = threading.Lock()
+        self._secrets = {}  # secret_id -> (value, fetched_at)
+        self._refreshing = set()
+
+    def get(self, secret_id):
+        entry = self._secrets.get(secret_id)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self._refresh_after:
+                return value
+            if age < self._ttl:
+                # still valid; refresh in the background so callers never wait on it
+                self._refresh_async(secret_id)
+                return value
+
+        return self._fetch(secret_id)
+
+    def invalidate(self, secret_id=None):
+        with self._lock:
+            if secret_id is None:
+                self._secrets.clear()
+            else:
+                self._secrets.pop(secret_id, None)
+
+    def _fetch(self, secret_id):
+        secret = self._client.get_secret_value(SecretId=secret_id)
+        value = secret["SecretString"]
+        with self._lock:
+            self._secrets[secret_id] = (value, time.monotonic())
+        return value
+
+    def _refresh_async(self, secret_id):
+        with self._lock:
+            if secret_id in self._refreshing:
+                return
+            self._refreshing.add(secret_id)
+
+        def refresh():
+            try:
+                self._fetch(secret_id)
+            except Exception as e:
+                # keep serving the cached value until it expires
+                logging.warning(f"Background refresh of secret {secret_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(secret_id)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+def get_secret_cache(region_name):
+    # one cache per process, shared by all user sessions
+    return RESOURCES.get("secrets", SecretCache, region_name, SECRETS_TTL_SECONDS)
+
+
+def _is_authentication_failure(exc):
+    return "authentication failed" in str(exc).lower()
+
+
+def refresh_credentials_on_connect(engine, secrets, username_id, password_id):
+    # supply the cached credentials to every new DBAPI connection; if the login is rejected
+    # (e.g. the password was rotated), drop the cached credentials and retry once
+    @event.listens_for(engine, "do_connect")
+    def connect(dialect, conn_rec, cargs, cparams):
+        cparams["user"] = secrets.get(username_id)
+        cparams["password"] = secrets.get(password_id)
+        try:
+            return dialect.connect(*cargs, **cparams)
+        except dialect.loaded_dbapi.OperationalError as e:
+            if not _is_authentication_failure(e):
+                raise
+            logging.warning("Database login rejected, refreshing credentials")
+            secrets.invalidate(username_id)
+            secrets.invalidate(password_id)
+            cparams["user"] = secrets.get(username_id)
+            cparams["password"] = secrets.get(password_id)
+            return dialect.connect(*cargs, **cparams)
+
+    return engine
+
+
+class OpenAIKeyRefresh:
+    # stands in for the chat completions client of ChatOpenAI; if a request is rejected
+    # with 401 (e.g. the API key was rotated), drop the cached key and retry once with the
+    # re-read key
+    def __init__(self, completions, secrets, secret_id):
+        self._completions = completions
+        self._secrets = secrets
+        self._secret_id = secret_id
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+    def create(self, **kwargs):
+        import openai
+
+        try:
+            return self._completions.create(**kwargs)
+        except openai.AuthenticationError:
+            logging.warning("OpenAI API key rejected, refreshing it")
+            self._secrets.invalidate(self._secret_id)
+            api_key = self._secrets.get(self._secret_id)
+            # the OpenAI client reads its api_key for every request
+            client = self._completions._client
+            if api_key == client.api_key:
+                raise
+            client.api_key = api_key
+            os.environ["OPENAI_API_KEY"] = api_key
+            return self._completions.create(**kwargs)
+
+
+def refresh_openai_key_on_auth_error(llm, secrets, secret_id):
+    # ChatOpenAI that re-reads its API key when OpenAI rejects it
+    llm.client = OpenAIKeyRefresh(llm.client, secrets, secret_id)
+    return llm
@@ -0,0 +1,103 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Lightweight SQL text utilities: tokenizing, canonicalizing and finding referenced tables
+# in LLM-generated PostgreSQL statements.
+
+import re
+
+_SQL_TOKEN = re.compile(
+    r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*")
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<space>\s+)
+    | (?P<other>.)
+    """,
+    re.S | re.X,
+)
+
+_SIMPLE_IDENTIFIER = re.compile(r"[a-z_][a-z0-9_$]*")
+
+
+def sql_token_spans(sql):
+    # (kind, text, start, end) tuples, without comments and whitespace
+    for match in _SQL_TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind not in ("comment", "space"):
+            yield kind, match.group(), match.start(), match.end()
+
+
+def sql_tokens(sql):
+    # (kind, text) pairs, without comments and whitespace
+    for kind, value, _, _ in sql_token_spans(sql):
+        yield kind, value
+
+
+def canonical_token(kind, value):
+    if kind == "word":
+        # unquoted keywords and identifiers are case-insensitive in PostgreSQL
+        return value.lower()
+    if kind == "quoted":
+        name = value[1:-1].replace('""', '"')
+        # "artists" and artists name the same table
+        return name if _SIMPLE_IDENTIFIER.fullmatch(name) else value
+    if kind == "number" and value.isdigit():
+        return str(int(value))
+    return value
+
+
+def normalize_sql(sql):
+    # canonical form: no comments, single spaces, lower-case keywords and identifiers,
+    # simple quoted identifiers unquoted, integer literals without leading zeros,
+    # no trailing semicolon; string literals are kept verbatim
+    tokens = [canonical_token(kind, value) for kind, value in sql_tokens(sql)]
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def referenced_tables(sql, table_names):
+    # known table names referenced anywhere in the statement
+    table_names = set(table_names)
+    return {
+        token
+        for token in (
+            canonical_token(kind, value)
+            for kind, value in sql_tokens(sql)
+            if kind in ("word", "quoted")
+        )
+        if token in table_names
+    }
+
+
+def is_select(sql):
+    # read-only queries that return rows: SELECT, and WITH ... SELECT
+    return normalize_sql(sql).startswith(("select ", "with "))
+
+
+def strip_trailing_semicolons(sql):
+    # the statement without trailing semicolons and comments, so it can be nested in
+    # another statement
+    end = 0
+    for _, value, _, token_end in sql_token_spans(sql):
+        if value != ";":
+            end = token_end
+    return sql[:end]
+
+
+def has_order_by(sql):
+    # whether the statement itself is ordered, ignoring ORDER BY in subqueries, window
+    # functions and aggregates
+    depth = 0
+    previous = None
+    for kind, value in sql_tokens(sql):
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+        elif depth == 0 and kind == "word" and value.lower() == "by":
+            if previous == "order":
+                return True
+        previous = value.lower() if depth == 0 else None
+    return False
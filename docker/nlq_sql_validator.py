@@ -0,0 +1,323 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Local validation of generated SQL, in place of the LLM query checker: the statement must be a
+# single read-only query whose tables and qualified columns exist in the cached schema. Common
+# mistakes are fixed first: MySQL backticks, mis-cased quoted names, double-quoted string values,
+# SELECT TOP and LIMIT before ORDER BY. The LLM checker only runs when validation fails.
+
+import logging
+import os
+
+from nlq_metrics import METRICS
+from nlq_sql import canonical_token, sql_token_spans, strip_trailing_semicolons
+
+# ***** CONFIGURABLE PARAMETERS *****
+SQL_VALIDATION_ENABLED = (
+    os.environ.get("SQL_VALIDATION_ENABLED", "true").lower() == "true"
+)
+
+# statements and functions that write data, change settings or reach outside the database
+_WRITE_KEYWORDS = {
+    "insert", "update", "delete", "merge", "drop", "alter", "create", "truncate",
+    "grant", "revoke", "copy", "vacuum", "reindex", "refresh", "into",
+}  # fmt: skip
+_UNSAFE_FUNCTIONS = {
+    "pg_sleep", "pg_terminate_backend", "pg_cancel_backend", "pg_read_file",
+    "pg_read_binary_file", "pg_ls_dir", "lo_import", "lo_export", "dblink", "set_config",
+}  # fmt: skip
+# keywords that end a table reference in a FROM clause
+_CLAUSE_KEYWORDS = {
+    "where", "group", "order", "having", "limit", "offset", "union", "intersect",
+    "except", "window", "fetch", "for", "select", "on", "using", "natural", "join",
+    "inner", "left", "right", "full", "cross", "outer", "lateral", "tablesample",
+}  # fmt: skip
+_JOIN_KEYWORDS = {
+    "natural", "inner", "left", "right", "full", "cross", "outer", "lateral", "on",
+    "using", "tablesample",
+}  # fmt: skip
+_COMPARISONS = {"=", "<", ">", "like", "ilike"}
+
+
+class SqlValidationError(Exception):
+    def __init__(self, problems):
+        super().__init__(f"Generated SQL failed validation: {'; '.join(problems)}")
+        self.problems = problems
+
+
+def _tokens(sql):
+    return list(sql_token_spans(sql))
+
+
+def _apply(sql, edits):
+    # edits are non-overlapping (start, end, replacement) spans of sql
+    for start, end, replacement in sorted(edits, reverse=True):
+        sql = sql[:start] + replacement + sql[end:]
+    return sql
+
+
+def _matching(tokens, i):
+    # index of the parenthesis closing the one at i, or None
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j][1] == "(":
+            depth += 1
+        elif tokens[j][1] == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    return None
+
+
+def _in_list(tokens, i):
+    # whether tokens[i] is an item of an IN (...) list
+    j = i - 1
+    while j > 0 and (tokens[j][1] == "," or tokens[j][0] in ("quoted", "string")):
+        j -= 1
+    return j > 0 and tokens[j][1] == "(" and tokens[j - 1][1].lower() == "in"
+
+
+def _word(token):
+    kind, value = token[0], token[1]
+    if kind in ("word", "quoted"):
+        return canonical_token(kind, value)
+    return None
+
+
+class SqlValidator:
+    def __init__(self, db):
+        self._db = db
+
+    def validate(self, sql):
+        # (fixed statement, problems); the statement can run when there are no problems
+        sql = strip_trailing_semicolons(sql.strip())
+        columns = self._schema_columns()
+        fixes = []
+        sql = self._fix_identifiers(sql, columns, fixes)
+        sql = self._fix_limit(sql, fixes)
+        problems = self._problems(sql, columns)
+
+        if fixes:
+            METRICS.incr("sql_validation_fixes", len(fixes))
+            logging.info(f"Generated SQL fixed: {fixes}")
+        METRICS.incr("sql_validation_failed" if problems else "sql_validation_passed")
+        return sql, problems
+
+    def _schema_columns(self):
+        # {table name: column names} from the reflected schema, see nlq_schema.py
+        usable = set(self._db.get_usable_table_names())
+        return {
+            table.name: {column.name for column in table.columns}
+            for table in self._db._metadata.sorted_tables
+            if table.name in usable
+        }
+
+    def _fix_identifiers(self, sql, columns, fixes):
+        tokens = _tokens(sql)
+        known = set(columns) | {name for names in columns.values() for name in names}
+        aliases = {
+            tokens[i + 1][1][1:-1]
+            for i in range(len(tokens) - 1)
+            if tokens[i][1].lower() == "as" and tokens[i + 1][0] == "quoted"
+        }
+        edits = []
+        i = 0
+        while i < len(tokens):
+            kind, value, start, end = tokens[i]
+            if value == "`":
+                # MySQL-style quoting
+                close = next(
+                    (j for j in range(i + 1, len(tokens)) if tokens[j][1] == "`"), None
+                )
+                if close is not None:
+                    name = sql[end : tokens[close][2]]
+                    edits.append((start, tokens[close][3], f'"{name}"'))
+                    fixes.append(f"`{name}` quoted for PostgreSQL")
+                    i = close + 1
+                    continue
+            elif kind == "quoted":
+                name = value[1:-1].replace('""', '"')
+                previous = tokens[i - 1][1].lower() if i > 0 else ""
+                if name in known or name in aliases:
+                    pass
+                elif name.lower() in known:
+                    # "Artists" is not the same table as artists in PostgreSQL
+                    edits.append((start, end, name.lower()))
+                    fixes.append(f"{value} matched to {name.lower()}")
+                elif previous in _COMPARISONS or _in_list(tokens, i):
+                    # a value in double quotes, which PostgreSQL reads as a column name
+                    edits.append((start, end, "'" + name.replace("'", "''") + "'"))
+                    fixes.append(f"{value} used as a string value")
+            i += 1
+        return _apply(sql, edits)
+
+    def _fix_limit(self, sql, fixes):
+        tokens = _tokens(sql)
+        top_level = []
+        depth = 0
+        for index, token in enumerate(tokens):
+            if token[1] == "(":
+                depth += 1
+            elif token[1] == ")":
+                depth -= 1
+            elif depth == 0:
+                top_level.append(index)
+        words = [(index, tokens[index][1].lower()) for index in top_level]
+
+        # SELECT TOP n (SQL Server) as LIMIT n
+        for (index, word), (next_index, _) in zip(words, words[1:]):
+            if (
+                word == "select"
+                and tokens[next_index][1].lower() == "top"
+                and next_index + 1 < len(tokens)
+                and tokens[next_index + 1][0] == "number"
+                and not any(w == "limit" for _, w in words)
+            ):
+                count = tokens[next_index + 1][1]
+                sql = _apply(
+                    sql, [(tokens[next_index][2], tokens[next_index + 1][3], "")]
+                )
+                fixes.append(f"TOP {count} as LIMIT {count}")
+                return self._fix_limit(f"{sql.rstrip()}\nLIMIT {count}", fixes)
+
+        # LIMIT (and OFFSET) placed before ORDER BY
+        limit = next((i for i, w in words if w == "limit"), None)
+        order = next((i for i, w in words if w == "order"), None)
+        if limit is not None and order is not None and limit < order:
+            end = limit + 2
+            if end + 1 < len(tokens) and tokens[end][1].lower() == "offset":
+                end += 2
+            if end <= len(tokens) and end <= order:
+                clause = sql[tokens[limit][2] : tokens[end - 1][3]]
+                sql = _apply(sql, [(tokens[limit][2], tokens[end - 1][3], "")])
+                fixes.append(f"{clause} moved after ORDER BY")
+                return f"{sql.rstrip()}\n{clause}"
+        return sql
+
+    def _problems(self, sql, columns):
+        tokens = _tokens(sql)
+        if not tokens:
+            return ["empty statement"]
+        problems = []
+        values = [value.lower() for _, value, _, _ in tokens]
+
+        if ";" in values:
+            problems.append("more than one statement")
+        if values[0] not in ("select", "with", "("):
+            problems.append("only SELECT queries are allowed")
+        for kind, value, _, _ in tokens:
+            if kind == "word" and value.lower() in _WRITE_KEYWORDS:
+                problems.append(f"{value.upper()} is not allowed in a read-only query")
+            elif kind == "other" and value in ("'", '"'):
+                problems.append("unterminated quoted string or name")
+        for i, (kind, value, _, _) in enumerate(tokens[:-1]):
+            if value.lower() in _UNSAFE_FUNCTIONS and tokens[i + 1][1] == "(":
+                problems.append(f"{value} is not allowed")
+        if values.count("(") != values.count(")"):
+            problems.append("unbalanced parentheses")
+            return problems
+
+        references, ctes = self._table_references(tokens)
+        aliases = {}
+        reference_positions = set()
+        for position, schema, table, alias in references:
+            reference_positions.update(position)
+            own_schema = schema is None or schema == (self._db._schema or "public")
+            if table in ctes or not own_schema:
+                continue
+            if table not in columns:
+                problems.append(f"unknown table {table}")
+                continue
+            aliases[table] = table
+            if alias is not None:
+                aliases[alias] = table
+
+        # qualified column references, e.g. a.displayname
+        for i in range(len(tokens) - 2):
+            if i in reference_positions or tokens[i + 1][1] != ".":
+                continue
+            qualifier, column = _word(tokens[i]), _word(tokens[i + 2])
+            table = aliases.get(qualifier)
+            if table is not None and column is not None and column not in columns[table]:
+                problems.append(f"unknown column {qualifier}.{column}")
+        return problems
+
+    @staticmethod
+    def _table_references(tokens):
+        # ([(token positions, schema, table, alias)], CTE names) for the tables read in
+        # FROM and JOIN clauses; subqueries and functions in FROM are skipped
+        ctes = set()
+        for i, token in enumerate(tokens[:-1]):
+            name = _word(token)
+            follow = i + 1
+            if tokens[follow][1] == "(":
+                close = _matching(tokens, follow)
+                follow = close + 1 if close is not None else len(tokens)
+            if (
+                name is not None
+                and follow + 1 < len(tokens)
+                and tokens[follow][1].lower() == "as"
+                and tokens[follow + 1][1] == "("
+            ):
+                ctes.add(name)
+
+        references = []
+        # per parenthesis level: whether it is a query, and whether in its FROM clause
+        levels = [{"query": True, "from": False}]
+        expect_table = False
+        i = 0
+        while i < len(tokens):
+            kind, value, _, _ = tokens[i]
+            word = value.lower()
+            if value == "(":
+                is_query = i + 1 < len(tokens) and tokens[i + 1][1].lower() in (
+                    "select",
+                    "with",
+                )
+                levels.append({"query": is_query, "from": False})
+                expect_table = False
+            elif value == ")":
+                if len(levels) > 1:
+                    levels.pop()
+            elif not levels[-1]["query"]:
+                pass
+            elif kind == "word" and word in ("from", "join"):
+                levels[-1]["from"] = True
+                expect_table = True
+            elif value == "," and levels[-1]["from"]:
+                expect_table = True
+            elif kind == "word" and word in _CLAUSE_KEYWORDS:
+                # join conditions and join types continue the FROM clause
+                if word not in _JOIN_KEYWORDS:
+                    levels[-1]["from"] = False
+                expect_table = False
+            elif expect_table and kind in ("word", "quoted"):
+                if word == "only":
+                    i += 1
+                    continue
+                expect_table = False
+                position = [i]
+                schema, table = None, _word(tokens[i])
+                if i + 2 < len(tokens) and tokens[i + 1][1] == ".":
+                    schema, table = table, _word(tokens[i + 2])
+                    position += [i + 1, i + 2]
+                    i += 2
+                if i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+                    # a set-returning function, e.g. generate_series(...)
+                    i += 1
+                    continue
+                alias = None
+                following = i + 1
+                if following < len(tokens) and tokens[following][1].lower() == "as":
+                    following += 1
+                if following < len(tokens):
+                    candidate = _word(tokens[following])
+                    if candidate is not None and candidate not in _CLAUSE_KEYWORDS:
+                        alias = candidate
+                references.append((position, schema, table, alias))
+            i += 1
+        return references, ctes
+
+
+def load_sql_validator(db):
+    if not SQL_VALIDATION_ENABLED:
+        return None
+    return SqlValidator(db)
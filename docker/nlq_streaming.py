@@ -0,0 +1,103 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Streams LLM tokens into the Streamlit chat as they arrive: the generated SQL is rendered as
+# soon as it is complete (before it is executed), then the answer streams in.
+# Also runs the pipeline on the shared worker pool while showing queue position and wait time.
+
+import logging
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from nlq_chain import current_llm_stage
+from nlq_executor import register_thread_context
+from nlq_metrics import METRICS
+
+# interval at which the queue status is refreshed while waiting for a worker
+STATUS_POLL_SECONDS = 0.25
+
+
+class StreamlitStreamHandler(BaseCallbackHandler):
+    def __init__(self, sql_placeholder, answer_placeholder):
+        # tokens of the answer generation go to the answer placeholder, and tokens of the
+        # SQL generation and query checker calls to the SQL placeholder
+        self._sql_placeholder = sql_placeholder
+        self._answer_placeholder = answer_placeholder
+        self._llm_started_at = None
+        self._text = ""
+        self.time_to_first_token = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._start_llm_call()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._start_llm_call()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if not self._text and self.time_to_first_token is None:
+            # first token of the request, i.e. of the SQL generation call
+            self.time_to_first_token = time.perf_counter() - self._llm_started_at
+            METRICS.observe("llm_time_to_first_token_seconds", self.time_to_first_token)
+            logging.info(f"Time to first token: {self.time_to_first_token:.3f}s")
+
+        self._text += token
+        if current_llm_stage() != "answer_generation":
+            self._sql_placeholder.code(self._text, language="sql")
+        else:
+            self._answer_placeholder.markdown(self._text)
+
+    def on_llm_end(self, response, **kwargs):
+        if current_llm_stage() != "answer_generation":
+            # complete SQL, shown while the query executes
+            sql_cmd = response.generations[0][0].text.strip()
+            self._sql_placeholder.code(sql_cmd, language="sql")
+
+    def _start_llm_call(self):
+        self._llm_started_at = time.perf_counter()
+        self._text = ""
+
+
+def with_script_run_ctx(fn):
+    # lets a worker thread write to the calling session's placeholders (streamed tokens)
+    ctx = get_script_run_ctx()
+
+    def run(*args, **kwargs):
+        add_script_run_ctx(ctx=ctx)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            add_script_run_ctx(ctx=None)
+
+    return run
+
+
+# worker threads of the hedged SQL generation write to the session too, see nlq_hedging.py
+register_thread_context(with_script_run_ctx)
+
+
+def wait_for_task(task, status_placeholder, timeout):
+    # wait for an NlqTask, showing its queue position and wait time; the task is cancelled on
+    # timeout, or when Streamlit stops this script run (e.g. the user navigated away)
+    try:
+        # a failed task raises its own error at once, even a timeout of an LLM call
+        while not task.wait(STATUS_POLL_SECONDS):
+            if task.elapsed() > timeout:
+                METRICS.incr("executor_timeouts")
+                raise TimeoutError(f"No answer within {timeout} seconds.")
+            position = task.queue_position()
+            if position:
+                status_placeholder.caption(
+                    f"Waiting in queue, position {position} "
+                    f"({task.wait_time():.1f}s)"
+                )
+            else:
+                status_placeholder.caption(
+                    f"Running (queued {task.wait_time():.1f}s, "
+                    f"total {task.elapsed():.1f}s)"
+                )
+        return task.result()
+    except BaseException:
+        task.cancel()
+        raise
+    finally:
+        status_placeholder.empty()
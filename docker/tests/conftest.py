@@ -0,0 +1,7 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# The nlq_*.py modules are flat modules in docker/, imported as in the Docker image.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Template answers for single values, rows and empty results, see nlq_answers.py.
+
+import decimal
+
+import pyarrow as pa
+import pytest
+
+from nlq_answers import SHAPES, _format_value, template_answer
+
+
+def _answer(question, **columns):
+    table = pa.table({name: [value] for name, value in columns.items()})
+    return template_answer(question, table, SHAPES)
+
+
+@pytest.mark.parametrize(
+    "value, text",
+    [
+        (15086, "15086"),
+        (3.0, "3"),
+        (63.2135, "63.21"),
+        (2.5, "2.5"),
+        (0.001, "0.001"),
+        (decimal.Decimal("0.004"), "0.004"),
+        (1e-7, "1e-07"),
+        (-0.001, "-0.001"),
+        (None, "no value"),
+    ],
+)
+def test_format_value(value, text):
+    assert _format_value(value) == text
+
+
+def test_count_answer():
+    assert _answer("How many artists are there?", count=15086) == (
+        "There are 15086 artists."
+    )
+
+
+def test_percentage_is_not_a_count():
+    answer = _answer(
+        "How many artists are deceased as a percentage of all artists?",
+        percentage=63.2135,
+    )
+    assert answer == "The percentage is 63.21."
+
+
+def test_fraction_is_not_a_count():
+    answer = _answer("How many works were acquired per year?", avg=12.5)
+    assert answer == "The avg is 12.5."
+
+
+def test_null_scalar_goes_to_llm():
+    assert _answer("What is the average weight?", avg=None) is None
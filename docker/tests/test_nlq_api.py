@@ -0,0 +1,61 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Headless API: bearer token and request body cap, and no Streamlit runtime, see nlq_api.py.
+
+import http.client
+import os
+import subprocess
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import nlq_api
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(nlq_api, "NLQ_API_TOKEN", "s3cret")
+    monkeypatch.setattr(nlq_api, "NLQ_API_MAX_BODY_BYTES", 64)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), nlq_api.NlqRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def _request(address, method, path, body=None, token=None):
+    connection = http.client.HTTPConnection(*address, timeout=10)
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    status = response.status
+    response.read()
+    connection.close()
+    return status
+
+
+def test_requests_without_the_token_are_rejected(server):
+    assert _request(server, "GET", "/health") == 200
+    assert _request(server, "GET", "/metrics") == 401
+    assert _request(server, "GET", "/metrics", token="wrong") == 401
+    assert _request(server, "GET", "/metrics", token="s3cret") == 200
+    assert _request(server, "POST", "/query", body=b"{}") == 401
+
+
+def test_large_bodies_are_rejected(server):
+    body = b'{"question": "' + b"x" * 100 + b'"}'
+    assert _request(server, "POST", "/query", body=body, token="s3cret") == 413
+    assert _request(server, "POST", "/unknown", body=b"{}", token="s3cret") == 404
+
+
+@pytest.mark.parametrize("module", ["nlq_bedrock", "nlq_openai", "nlq_sagemaker"])
+def test_the_chain_is_built_without_streamlit(module):
+    # in a fresh interpreter, as other tests import the apps' Streamlit modules
+    script = (
+        f"import sys, importlib, nlq_api; importlib.import_module({module!r}); "
+        "sys.exit('streamlit' in sys.modules)"
+    )
+    docker_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", script], cwd=docker_dir, check=True)
@@ -0,0 +1,61 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Streamed Bedrock calls: no stop sequences are sent to the model or left in the shared
+# model_kwargs, and the text is cut at the stop sequence on the client, see nlq_bedrock.py.
+
+import json
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from nlq_bedrock import StreamingBedrock
+
+
+class _Client:
+    # bedrock-runtime client streaming the text in the given pieces
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.requests = []
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.requests.append(kwargs)
+        events = (
+            {"chunk": {"bytes": json.dumps({"outputText": piece}).encode("utf-8")}}
+            for piece in self.pieces
+        )
+        return {"body": events}
+
+
+class _Tokens(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.append(token)
+
+
+def _llm(client):
+    return StreamingBedrock(
+        client=client,
+        model_id="amazon.titan-text-express-v1",
+        model_kwargs={"temperature": 0.3, "topP": 1},
+        streaming=True,
+    )
+
+
+def test_stop_sequences_are_not_sent():
+    client = _Client(["SELECT count(*) ", "FROM artists;\nSQL", "Result: [(15086,)]"])
+    llm = _llm(client)
+    tokens = _Tokens()
+
+    text = llm.invoke("question", stop=["\nSQLResult:"], config={"callbacks": [tokens]})
+
+    assert text == "SELECT count(*) FROM artists;"
+    assert "".join(tokens.tokens) == text
+    body = json.loads(client.requests[0]["body"])
+    assert body["textGenerationConfig"] == {"temperature": 0.3, "topP": 1}
+    assert llm.model_kwargs == {"temperature": 0.3, "topP": 1}
+
+
+def test_text_without_a_stop_sequence_is_kept():
+    client = _Client(["There are 15086 ", "artists.\nSQL"])
+    llm = _llm(client)
+    assert llm.invoke("question", stop=["\nSQLResult:"]) == "There are 15086 artists.\nSQL"
@@ -0,0 +1,23 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Prompt token budget: room is left for the completion, and estimated counts get a safety
+# margin, see nlq_budget.py.
+
+from nlq_budget import PromptBudget
+
+
+def _words(text):
+    return len(text.split())
+
+
+def test_completion_tokens_are_reserved():
+    budget = PromptBudget(100, _words, completion_tokens=40)
+    base = "word " * 50
+    examples = [("word " * 8, "word " * 4)] * 3
+    # 60 prompt tokens are left: two truncated examples, 50 + 2 * 4 + 2 separators
+    assert budget.fit(base, examples) == (2, True, 60)
+
+
+def test_estimated_counts_get_a_margin():
+    budget = PromptBudget(100, _words, completion_tokens=0, margin=1.25)
+    assert budget.count("word " * 10) == 13
+    assert budget.count("") == 0
@@ -0,0 +1,55 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Semantic answer cache: only questions naming the same values share an answer, and answers are
+# dropped when a table they read changes, see nlq_cache.py.
+
+from nlq_cache import SemanticAnswerCache, question_literals
+from nlq_chain import RESULT_TABLE_KEY
+from nlq_results import to_arrow
+
+
+class _SameEmbeddings:
+    # every question embeds identically, the worst case for the similarity threshold
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+class _TableEmbeddings:
+    # questions about artists and about artworks are dissimilar
+    def embed_query(self, text):
+        return [1.0, 0.0] if "artists" in text else [0.0, 1.0]
+
+
+def _output(sql, answer):
+    return {"result": answer, RESULT_TABLE_KEY: to_arrow(["count"], [(1,)], sql)}
+
+
+def _cache(embeddings):
+    return SemanticAnswerCache(embeddings, table_names=lambda: ["artists", "artworks"])
+
+
+def test_question_literals():
+    assert question_literals(
+        "How many artists with nationality 'Italian' were born before 1900?"
+    ) == ("1900", "italian")
+    assert question_literals("How many artworks are by Pablo Picasso?") == (
+        "pablo",
+        "picasso",
+    )
+
+
+def test_questions_naming_other_values_miss():
+    cache = _cache(_SameEmbeddings())
+    italian = "How many artists have the nationality 'Italian'?"
+    cache.store(italian, _output("SELECT count(*) FROM artists", "There are 1."))
+    assert cache.lookup(italian)[0]["result"] == "There are 1."
+    assert cache.lookup("How many artists have the nationality 'French'?")[0] is None
+    assert cache.lookup("How many artists were born before 1950?")[0] is None
+
+
+def test_invalidate_tables():
+    cache = _cache(_TableEmbeddings())
+    cache.store("How many artists?", _output("SELECT count(*) FROM artists", "1"))
+    cache.store("How many artworks?", _output("SELECT count(*) FROM artworks", "2"))
+    cache.invalidate_tables({"artworks"})
+    assert cache.lookup("How many artists?")[0] is not None
+    assert cache.lookup("How many artworks?")[0] is None
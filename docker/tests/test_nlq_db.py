@@ -0,0 +1,55 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Paging larger results: pages of an unordered query do not overlap or skip rows, see
+# nlq_db.py.
+
+from sqlalchemy import text
+
+from nlq_db import NlqSQLDatabase, create_db_engine, page_order_by
+from nlq_sql import has_order_by
+
+
+def _database(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'nlq.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE artists (name TEXT, born INTEGER)"))
+        connection.execute(
+            text("INSERT INTO artists VALUES (:name, :born)"),
+            [{"name": f"artist {i:03}", "born": 1900 - i % 7} for i in range(250)],
+        )
+    return NlqSQLDatabase(engine, page_size=100)
+
+
+def test_has_order_by():
+    assert has_order_by("SELECT name FROM artists ORDER BY name;")
+    assert not has_order_by("SELECT name FROM artists")
+    assert not has_order_by(
+        "SELECT name, row_number() OVER (ORDER BY born) FROM artists"
+    )
+    assert not has_order_by(
+        "SELECT * FROM (SELECT name FROM artists ORDER BY name) AS a"
+    )
+
+
+def test_columns_without_an_ordering_are_not_sorted_on():
+    # PostgreSQL type OIDs: int4 23, text 25, json 114, point 600
+    orderable = {23, 25}
+    assert page_order_by([23, 25], orderable) == " ORDER BY 1, 2"
+    assert page_order_by([25, 114, 23, 600], orderable) == (
+        " ORDER BY 1, 3, CAST(nlq_page AS text)"
+    )
+    assert page_order_by([114], orderable) == " ORDER BY CAST(nlq_page AS text)"
+
+
+def test_pages_of_an_unordered_query_cover_every_row_once(tmp_path):
+    db = _database(tmp_path)
+    sql = "SELECT name, born FROM artists;"
+    pages = [db.fetch_page(sql, page) for page in range(3)]
+    assert [page.num_rows for page in pages] == [100, 100, 50]
+    names = [name for page in pages for name in page.column("name").to_pylist()]
+    assert sorted(names) == sorted(f"artist {i:03}" for i in range(250))
+
+
+def test_pages_keep_the_query_order(tmp_path):
+    db = _database(tmp_path)
+    page = db.fetch_page("SELECT name FROM artists ORDER BY name DESC", 0)
+    assert page.column("name")[0].as_py() == "artist 249"
@@ -0,0 +1,60 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# A request failing with an LLM provider deadline surfaces that error at once, rather than
+# being taken for a request still running until the request timeout.
+
+import time
+
+import pytest
+
+from nlq_api import ApiError, task_response
+from nlq_clients import ProviderDeadlineError
+from nlq_executor import NlqExecutor
+from nlq_streaming import wait_for_task
+
+
+class _Placeholder:
+    def __init__(self):
+        self.captions = []
+
+    def caption(self, text):
+        self.captions.append(text)
+
+    def empty(self):
+        pass
+
+
+def _deadline_exceeded():
+    raise ProviderDeadlineError("No response from bedrock within the deadline.")
+
+
+def _failed_task():
+    executor = NlqExecutor(workers=1, queue_size=1)
+    task = executor.submit(_deadline_exceeded)
+    task.wait(5)
+    return task
+
+
+def test_wait_for_task_raises_deadline_error():
+    task = _failed_task()
+    placeholder = _Placeholder()
+    start = time.monotonic()
+    with pytest.raises(ProviderDeadlineError):
+        wait_for_task(task, placeholder, timeout=30)
+    assert time.monotonic() - start < 1
+    assert placeholder.captions == []
+
+
+def test_task_response_raises_deadline_error():
+    task = _failed_task()
+    start = time.monotonic()
+    with pytest.raises(ProviderDeadlineError):
+        task_response("How many artists are there?", task, timeout=30)
+    assert time.monotonic() - start < 1
+
+
+def test_task_response_times_out_running_task():
+    executor = NlqExecutor(workers=1, queue_size=1)
+    task = executor.submit(time.sleep, 0.5)
+    with pytest.raises(ApiError) as error:
+        task_response("How many artists are there?", task, timeout=0.05)
+    assert error.value.status == 504
@@ -0,0 +1,27 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# Resources keyed on an object are rebuilt when it is replaced, even by an object at the same
+# address, see nlq_resources.py.
+
+from nlq_resources import ResourceRegistry
+
+
+class _Llm:
+    pass
+
+
+def test_a_replaced_argument_rebuilds_the_resource():
+    registry = ResourceRegistry()
+    built = []
+
+    def build_chain(llm):
+        built.append(None)
+        return len(built)
+
+    # each llm is dropped by the caller at once; a freed llm's id would be reused by the next
+    for _ in range(10):
+        registry.get("chain", build_chain, _Llm())
+    assert len(built) == 10
+
+    llm = _Llm()
+    chain = registry.get("chain", build_chain, llm)
+    assert registry.get("chain", build_chain, llm) == chain == 11
@@ -0,0 +1,71 @@
+# Natural Language Query (NLQ) demo using Amazon RDS for PostgreSQL.
+# A rotated OpenAI API key is re-read when OpenAI rejects the cached one, see nlq_secrets.py.
+
+import httpx
+import openai
+import pytest
+
+from nlq_secrets import OpenAIKeyRefresh
+
+
+class _Secrets:
+    # the cached key is stale until invalidated
+    def __init__(self, cached, current):
+        self.cached, self.current = cached, current
+
+    def get(self, secret_id):
+        return self.cached
+
+    def invalidate(self, secret_id=None):
+        self.cached = self.current
+
+
+def _completion(request):
+    if request.headers["Authorization"] != "Bearer new-key":
+        return httpx.Response(401, json={"error": {"message": "Incorrect API key"}})
+    return httpx.Response(
+        200,
+        json={
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-3.5-turbo",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "SELECT 1"},
+                    "finish_reason": "stop",
+                }
+            ],
+        },
+    )
+
+
+def _completions(secrets):
+    client = openai.OpenAI(
+        api_key=secrets.get("/nlq/OpenAIAPIKey"),
+        max_retries=0,
+        http_client=httpx.Client(transport=httpx.MockTransport(_completion)),
+    )
+    return OpenAIKeyRefresh(client.chat.completions, secrets, "/nlq/OpenAIAPIKey")
+
+
+def _create(completions):
+    return completions.create(
+        model="gpt-3.5-turbo", messages=[{"role": "user", "content": "?"}]
+    )
+
+
+def test_rotated_key_is_reread(monkeypatch):
+    # the refreshed key is also set for clients created later
+    monkeypatch.setenv("OPENAI_API_KEY", "old-key")
+    completions = _completions(_Secrets("old-key", "new-key"))
+    assert _create(completions).choices[0].message.content == "SELECT 1"
+    # later requests use the new key without another refresh
+    assert _create(completions).choices[0].message.content == "SELECT 1"
+
+
+def test_unchanged_key_is_not_retried():
+    completions = _completions(_Secrets("bad-key", "bad-key"))
+    with pytest.raises(openai.AuthenticationError):
+        _create(completions)